@@ -3,10 +3,10 @@
 Debug script to examine token and understand OneNote API access
 """
 
-import requests
-import json
-from msal import PublicClientApplication
 import os
+from msal import PublicClientApplication
+
+from graph_probe import probe_session
 
 CLIENT_ID = os.getenv("ONENOTE_CLIENT_ID", "YOUR_CLIENT_ID_HERE")  # Set via environment variable or replace with your Azure AD app registration client ID
 SCOPES = ["Notes.Read", "User.Read"]
@@ -53,16 +53,12 @@ def debug_token():
         print(f"Could not decode token: {e}")
     
     # Test different endpoints
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+    session = probe_session(token, {"Accept": "application/json", "Content-Type": "application/json"})
     
     # Test User.Read
     print("\n🔍 Testing User.Read permission...")
     try:
-        response = requests.get("https://graph.microsoft.com/v1.0/me", headers=headers)
+        response = session.get("https://graph.microsoft.com/v1.0/me")
         if response.status_code == 200:
             user_data = response.json()
             print(f"✅ User.Read works! User: {user_data.get('displayName', 'Unknown')}")
@@ -82,7 +78,7 @@ def debug_token():
     for endpoint in endpoints:
         try:
             print(f"\nTesting: {endpoint}")
-            response = requests.get(endpoint, headers=headers)
+            response = session.get(endpoint)
             print(f"  Status: {response.status_code}")
             
             if response.status_code == 200:
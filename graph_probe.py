@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the Graph diagnostic scripts
+"""
+
+import json
+import atexit
+
+import requests
+
+from token_cache import load_token_cache, save_token_cache
+
+BATCH_URL = "https://graph.microsoft.com/v1.0/$batch"
+
+_APPS = {}
+
+
+def get_app(client_id):
+    """Return the MSAL app for ``client_id``, created with the persisted token cache on first use."""
+    if client_id not in _APPS:
+        # Imported here: msal pulls in cryptography, which is slow to import
+        from msal import PublicClientApplication
+        cache = load_token_cache()
+        atexit.register(save_token_cache, cache)
+        _APPS[client_id] = PublicClientApplication(client_id, authority="https://login.microsoftonline.com/consumers",
+                                                   token_cache=cache)
+    return _APPS[client_id]
+
+
+def acquire_token(app, scopes):
+    """Sign in and return MSAL's result, or None if the device code flow could not start.
+
+    A cached sign-in is reused before falling back to the device code flow.
+    """
+    accounts = app.get_accounts()
+    if accounts:
+        result = app.acquire_token_silent(scopes, account=accounts[0])
+        if result:
+            return result
+    
+    flow = app.initiate_device_flow(scopes=scopes)
+    if not flow.get("user_code"):
+        print("❌ Device code flow failed")
+        return None
+    
+    print("📱 Please authenticate using the device code flow:")
+    print(flow["message"])
+    print()
+    return app.acquire_token_by_device_flow(flow)
+
+
+def probe_session(token, headers=None):
+    """Return a session authorised with ``token`` and carrying any extra ``headers``.
+
+    One session serves every probe so the TLS connection to Graph is reused.
+    """
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {token}"
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+class BatchResponse:
+    """One sub-response of a $batch call, read like a requests response."""
+    
+    def __init__(self, sub_response):
+        self.status_code = sub_response.get("status", 0)
+        self._body = sub_response.get("body")
+    
+    def json(self):
+        return self._body
+    
+    @property
+    def text(self):
+        return self._body if isinstance(self._body, str) else json.dumps(self._body)
+
+
+def batch_get(session, sub_requests):
+    """Send GET requests as a single $batch call and return the responses by id.
+
+    ``sub_requests`` maps an id to a URL relative to /v1.0.
+    """
+    envelopes = [{"id": request_id, "method": "GET", "url": url} for request_id, url in sub_requests.items()]
+    response = session.post(BATCH_URL, json={"requests": envelopes})
+    response.raise_for_status()
+    return {sub["id"]: BatchResponse(sub) for sub in response.json().get("responses", [])}
@@ -9,15 +9,38 @@ Uses Microsoft Graph API with device code flow authentication.
 import os
 import sys
 import json
+import base64
+import hashlib
+import binascii
 import requests
 import pathlib
 import time
 import re
+import random
 import logging
+import math
+import multiprocessing
+import threading
+import uuid
+import sqlite3
+import argparse
+import shutil
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from urllib.parse import urljoin, urlparse
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from msal import PublicClientApplication
 from html2text import HTML2Text
+from html2text.utils import escape_md
+from token_cache import TOKEN_CACHE_FILE, load_token_cache, save_token_cache
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library parser is the fallback
+    orjson = None
 
 # Configuration
 CLIENT_ID = os.getenv("ONENOTE_CLIENT_ID", "YOUR_CLIENT_ID_HERE")  # Set via environment variable or replace with your Azure AD app registration client ID
@@ -25,6 +48,45 @@ SCOPES = ["Notes.Read", "User.Read"]
 OUTPUT_DIR = pathlib.Path("output")
 MAX_RETRIES = 3
 BASE_DELAY = 1  # seconds
+MAX_DELAY = 30  # cap for computed backoff delays, in seconds
+MEDIA_WORKERS = 8  # concurrent media downloads per page
+MAX_MEDIA_SIZE = 10 * 1024 * 1024  # 10MB maximum file size for media downloads
+MEDIA_CHUNK_SIZE = 256 * 1024  # bytes copied per read when saving media
+MEDIA_DEDUPE_BYTES = 64 * 1024  # leading bytes hashed to detect identical media
+MEDIA_TIMEOUT = (5, 60)  # (connect, read) seconds for media downloads
+GRAPH_TIMEOUT = (5, 60)  # (connect, read) seconds for Graph API requests
+PAGE_WORKERS = 8  # pages converted and written concurrently
+CONVERT_WORKERS = os.cpu_count() or 1  # processes running HTML to Markdown conversion
+POOL_CONNECTIONS = 32  # number of per-host connection pools to keep
+POOL_MAXSIZE = 64  # keep-alive connections kept open per host
+THROTTLE_INITIAL = 8  # concurrent Graph requests allowed at start
+THROTTLE_MIN = 1
+THROTTLE_MAX = 32
+THROTTLE_WINDOW = 20  # completions between concurrency increases
+THROTTLE_TARGET_LATENCY = 2.0  # seconds; slower responses stop the increase
+CIRCUIT_COOLDOWN = 30  # seconds to pause after a full window of errors
+RATE_WINDOW = 60  # seconds covered by the request-rate sliding window
+RATE_HEADROOM = 0.1  # pause once less than this fraction of the quota remains
+BUCKET_RATE = 10  # sustained Graph requests per second, below the per-app limit
+BUCKET_CAPACITY = 30  # requests that may be sent in a burst
+MEDIA_INDEX_FILE = ".media_index.json"  # per-directory record of downloaded media and ETags
+RESPONSE_CACHE_FILE = ".graph_cache.sqlite"  # ETag-validated Graph GET responses, kept in the output directory
+
+# Options applied to every HTML2Text converter
+HTML2TEXT_CONFIG = {
+    "body_width": 0,  # Don't wrap lines
+    "ignore_images": False,
+    "ignore_emphasis": False,
+    "ignore_links": False,
+}
+
+_SAFE_TITLE_TRANS = str.maketrans({c: '_' for c in '<>:"/\\|?*'})  # characters not allowed in file names
+_BODY_START_RE = re.compile(r'<body\b[^>]*>', re.IGNORECASE)
+_BODY_END_RE = re.compile(r'</body\s*>', re.IGNORECASE)
+_FRACTION_RE = re.compile(r'\.\d+')
+GRAPH_ROOT = "https://graph.microsoft.com/v1.0"
+BATCH_URL = f"{GRAPH_ROOT}/$batch"
+MAX_BATCH_SIZE = 20  # Graph JSON batching accepts at most 20 requests per call
 
 # Setup logging
 logging.basicConfig(
@@ -38,37 +100,405 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _json_loads(data: bytes):
+    """Decode a JSON response body, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class _MarkdownConverter(HTML2Text):
+    """HTML2Text converter that collects remote image URLs while it parses.
+
+    Each remote <img> source is swapped for a placeholder during the single
+    parse html2text already does, so media can be downloaded and linked
+    afterwards without another pass over the HTML.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        for option, value in HTML2TEXT_CONFIG.items():
+            setattr(self, option, value)
+        self.placeholder_prefix = f"onenote-media-{uuid.uuid4().hex}-"
+        self.image_urls: List[str] = []
+        self._image_index: Dict[str, int] = {}
+    
+    def handle_tag(self, tag: str, attrs: Dict[str, Optional[str]], start: bool) -> None:
+        if tag == "img" and start:
+            src = attrs.get("src") or ""
+            if src.startswith("http"):
+                index = self._image_index.get(src)
+                if index is None:
+                    index = self._image_index[src] = len(self.image_urls)
+                    self.image_urls.append(src)
+                attrs["src"] = f"{self.placeholder_prefix}{index}-"
+        super().handle_tag(tag, attrs, start)
+
+
+def _body_html(html: str) -> str:
+    """Return the contents of the <body> element, or the input if it has none.
+
+    html2text emits nothing for <head>, so skipping it (OneNote puts the
+    title, meta tags and styles there) saves parsing it on every page.
+    """
+    start = _BODY_START_RE.search(html)
+    if not start:
+        return html
+    end = None
+    for end in _BODY_END_RE.finditer(html, start.end()):
+        pass
+    if end is None:
+        return html[start.end():]
+    return html[start.end():end.start()]
+
+
+def convert_html(html: str) -> Tuple[str, str, List[str]]:
+    """Convert an HTML document to Markdown.
+
+    Returns the Markdown, the placeholder prefix used for remote images and
+    the distinct image URLs in placeholder order. html2text keeps
+    per-document parser state on the instance, so each call gets a fresh
+    converter. Module-level so it can run in a ProcessPoolExecutor worker.
+    """
+    converter = _MarkdownConverter()
+    markdown = converter.handle(_body_html(html))
+    return markdown, converter.placeholder_prefix, converter.image_urls
+
+
+def create_session() -> requests.Session:
+    """Create the HTTP session shared by every request of an export.
+
+    Requests stay on HTTP/1.1 through requests; instead of multiplexing, a
+    large keep-alive pool lets concurrent requests reuse TLS connections and
+    Graph $batch collapses most small calls into one round trip.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+
+def backoff_delay(attempt: int) -> float:
+    """Return a full-jitter exponential backoff delay for the given attempt."""
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given as delta-seconds or as an HTTP-date."""
+    if value is None:
+        return None
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def parse_graph_datetime(value: Optional[str]) -> Optional[float]:
+    """Parse a Graph ISO 8601 timestamp such as lastModifiedDateTime into epoch seconds."""
+    if not value:
+        return None
+    # fromisoformat() before Python 3.11 needs "+00:00" for "Z" and exactly 3 or 6 fraction digits
+    value = _FRACTION_RE.sub(lambda m: m.group(0)[:7].ljust(7, '0'), value.replace('Z', '+00:00'))
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class Throttle:
+    """Adaptive limit on concurrent Graph requests.
+
+    Uses additive-increase/multiplicative-decrease: the limit grows by one
+    after every THROTTLE_WINDOW successful, fast completions and is halved
+    on each throttled (429), failed (5xx) or errored request. A window made
+    up entirely of errors opens a circuit that blocks new requests for
+    CIRCUIT_COOLDOWN seconds.
+    """
+    
+    def __init__(self, initial: int = THROTTLE_INITIAL, minimum: int = THROTTLE_MIN, maximum: int = THROTTLE_MAX,
+                 window: int = THROTTLE_WINDOW, target_latency: float = THROTTLE_TARGET_LATENCY):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.target_latency = target_latency
+        self._in_flight = 0
+        self._completed = 0
+        self._samples = deque(maxlen=window)
+        self._open_until = 0.0
+        self._condition = threading.Condition()
+    
+    def acquire(self) -> None:
+        """Block until a request slot is available."""
+        with self._condition:
+            while True:
+                remaining = self._open_until - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                elif self._in_flight >= int(self.limit):
+                    self._condition.wait()
+                else:
+                    break
+            self._in_flight += 1
+    
+    def release(self, status: int, latency: float) -> None:
+        """Release a slot and adjust the limit from the request outcome.
+
+        ``status`` is the HTTP status code, or 0 if no response was received.
+        """
+        failed = status == 0 or status == 429 or status >= 500
+        with self._condition:
+            self._in_flight -= 1
+            self._samples.append((failed, latency))
+            
+            if failed:
+                self.limit = max(self.minimum, self.limit * 0.5)
+                self._completed = 0
+                if len(self._samples) == self.window and all(error for error, _ in self._samples):
+                    logger.warning(f"Sustained Graph errors. Pausing requests for {CIRCUIT_COOLDOWN} seconds...")
+                    self._open_until = time.monotonic() + CIRCUIT_COOLDOWN
+                    self._samples.clear()
+            else:
+                self._completed += 1
+                if self._completed >= self.window:
+                    self._completed = 0
+                    average = sum(latency for _, latency in self._samples) / len(self._samples)
+                    if not any(error for error, _ in self._samples) and average <= self.target_latency:
+                        self.limit = min(self.maximum, self.limit + 1)
+            
+            self._condition.notify_all()
+
+
+class RateLimitWindow:
+    """Pre-emptive request pacing from the rate-limit headers Graph returns.
+
+    Tracks the advertised limit, remaining quota and reset time. Requests are
+    held until the window resets once the quota is nearly spent, and a
+    sliding window of send times keeps the rate under the limit per
+    RATE_WINDOW seconds.
+    """
+    
+    LIMIT_HEADERS = ("RateLimit-Limit", "x-ratelimit-limit", "x-ratelimit-limit-requests")
+    REMAINING_HEADERS = ("RateLimit-Remaining", "x-ratelimit-remaining", "x-ratelimit-remaining-requests")
+    RESET_HEADERS = ("RateLimit-Reset", "x-ratelimit-reset", "x-ratelimit-reset-requests")
+    
+    def __init__(self):
+        self.limit: Optional[float] = None
+        self.remaining = math.inf
+        self.reset_at = 0.0
+        self._sent = deque()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _header_value(headers, names: Tuple[str, ...]) -> Optional[float]:
+        for name in names:
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                continue
+        return None
+    
+    def update(self, headers) -> None:
+        """Record the quota reported by a response."""
+        limit = self._header_value(headers, self.LIMIT_HEADERS)
+        remaining = self._header_value(headers, self.REMAINING_HEADERS)
+        reset = self._header_value(headers, self.RESET_HEADERS)
+        with self._lock:
+            if limit:
+                self.limit = limit
+            if remaining is not None:
+                self.remaining = remaining
+            if reset is not None:
+                # Reset is either seconds from now or an epoch timestamp
+                self.reset_at = reset if reset > 1e9 else time.time() + reset
+    
+    def wait(self) -> None:
+        """Block until a request can be sent without exceeding the quota."""
+        while True:
+            with self._lock:
+                now = time.time()
+                while self._sent and now - self._sent[0] > RATE_WINDOW:
+                    self._sent.popleft()
+                
+                delay = 0.0
+                if self.limit and now < self.reset_at and (
+                        self.remaining <= 2 or self.remaining / self.limit < RATE_HEADROOM):
+                    delay = self.reset_at - now
+                elif self.limit and len(self._sent) >= self.limit:
+                    delay = RATE_WINDOW - (now - self._sent[0])
+                
+                if delay <= 0:
+                    self._sent.append(now)
+                    self.remaining -= 1
+                    return
+            logger.info(f"Approaching Graph rate limit. Waiting {delay:.1f} seconds...")
+            time.sleep(delay)
+
+
+class TokenBucket:
+    """Client-side request rate limit shared by all worker threads.
+
+    Tokens refill at ``rate`` per second up to ``capacity``. acquire()
+    reserves a token and sleeps until it is due, so callers are spaced out
+    before Graph has to answer with 429. drain() empties the bucket and
+    holds off refilling, making every thread back off after a Retry-After.
+    """
+    
+    def __init__(self, rate: float = BUCKET_RATE, capacity: float = BUCKET_CAPACITY):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        start = max(self._updated, self._resume_at)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+            self._updated = now
+    
+    def acquire(self) -> None:
+        """Take a token, sleeping until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            # A negative balance is a reservation on tokens still to come
+            delay = max(0.0, self._resume_at - now) + max(0.0, -self.tokens) / self.rate
+        if delay > 0:
+            time.sleep(delay)
+    
+    def drain(self, seconds: float) -> None:
+        """Empty the bucket and start refilling only after ``seconds``."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 0.0)
+            self._resume_at = max(self._resume_at, now + seconds)
+
+
+class BatchedGraphClient:
+    """Buffer Graph GET requests and send them through $batch.
+
+    Requests are queued under a caller-chosen id with add(). Every
+    MAX_BATCH_SIZE queued requests are sent as one $batch call, and flush()
+    sends whatever remains, so callers can submit lists of any length.
+    flush() returns every sub-response received so far, keyed by id.
+    """
+    
+    def __init__(self, exporter: "OneNoteExporter"):
+        self._exporter = exporter
+        self._pending: List[Tuple[str, Dict]] = []
+        self.responses: Dict[str, Dict] = {}
+    
+    def add(self, request_id: str, url: str, headers: Optional[Dict[str, str]] = None) -> None:
+        """Queue a GET of ``url`` (relative to the API root)."""
+        self._pending.append((request_id, {"url": url, "headers": headers}))
+        if len(self._pending) >= MAX_BATCH_SIZE:
+            self._send()
+    
+    def flush(self) -> Dict[str, Dict]:
+        """Send any queued requests and return all sub-responses by id."""
+        if self._pending:
+            self._send()
+        return self.responses
+    
+    def _send(self) -> None:
+        pending, self._pending = self._pending, []
+        results = self._exporter.call_graph_batch([sub_request for _, sub_request in pending])
+        for (request_id, _), result in zip(pending, results):
+            self.responses[request_id] = result
+
+
 class OneNoteExporter:
     """Main class for exporting OneNote content to Markdown."""
     
-    def __init__(self, client_id: str, scopes: List[str], output_dir: pathlib.Path):
+    def __init__(self, client_id: str, scopes: List[str], output_dir: pathlib.Path,
+                 token_cache_path: Optional[pathlib.Path] = TOKEN_CACHE_FILE,
+                 cache_path: Optional[pathlib.Path] = None):
         self.client_id = client_id
         self.scopes = scopes
         self.output_dir = output_dir
+        self.token_cache_path = token_cache_path
         self.token = None
-        self.session = requests.Session()
+        self.account_id: Optional[str] = None
+        self.session = create_session()
+        self.throttle = Throttle()
+        self.rate_limit = RateLimitWindow()
+        self.bucket = TokenBucket()
+        self._host_errors: Dict[str, int] = {}
+        self._host_lock = threading.Lock()
+        self._media_indexes: Dict[pathlib.Path, Dict[str, Dict]] = {}
+        self._media_lock = threading.Lock()
+        self._media_by_content: Dict[Tuple[pathlib.Path, str], str] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self.export_timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._convert_pool: Optional[ProcessPoolExecutor] = None
+        self._created_dirs: Set[pathlib.Path] = set()
+        self._cache = None
+        self._cache_lock = threading.Lock()
+        if cache_path is not None:
+            pathlib.Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            # Shared by the page worker threads; access is serialised by _cache_lock
+            self._cache = sqlite3.connect(str(cache_path), check_same_thread=False)
+            self._cache.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, etag TEXT, body BLOB, fetched_at INTEGER)"
+            )
+            self._cache.commit()
         
     def get_token(self) -> str:
-        """Authenticate using device code flow and return access token."""
+        """Authenticate and return an access token.
+
+        Tokens cached by a previous run are used silently; the device code
+        flow only runs when no cached account can be refreshed.
+        """
         if self.token:
             return self.token
-            
+        
+        cache = load_token_cache(self.token_cache_path)
         # Use the correct authority for personal accounts
-        app = PublicClientApplication(self.client_id, authority="https://login.microsoftonline.com/consumers")
-        flow = app.initiate_device_flow(scopes=self.scopes)
+        app = PublicClientApplication(self.client_id, authority="https://login.microsoftonline.com/consumers",
+                                      token_cache=cache)
         
-        if not flow.get("user_code"):
-            raise RuntimeError(f"Device code flow failed: {flow}")
-            
-        logger.info("Please authenticate using the device code flow:")
-        print(flow["message"])
+        result = None
+        accounts = app.get_accounts()
+        if accounts:
+            result = app.acquire_token_silent(self.scopes, account=accounts[0])
         
-        result = app.acquire_token_by_device_flow(flow)
+        if not result:
+            flow = app.initiate_device_flow(scopes=self.scopes)
+            
+            if not flow.get("user_code"):
+                raise RuntimeError(f"Device code flow failed: {flow}")
+                
+            logger.info("Please authenticate using the device code flow:")
+            print(flow["message"])
+            
+            result = app.acquire_token_by_device_flow(flow)
         
         if "access_token" not in result:
             raise RuntimeError(f"Failed to acquire token: {result.get('error_description', 'Unknown error')}")
-            
+        
+        save_token_cache(cache, self.token_cache_path)
         self.token = result["access_token"]
+        # Identifies whose data cached responses belong to
+        claims = result.get("id_token_claims") or {}
+        self.account_id = claims.get("oid") or claims.get("sub") or (
+            accounts[0].get("home_account_id") if accounts else None)
         # Set the correct headers for Microsoft Graph API
         self.session.headers.update({
             "Authorization": f"Bearer {self.token}",
@@ -78,71 +508,382 @@ class OneNoteExporter:
         logger.info("Successfully authenticated with Microsoft Graph")
         return self.token
     
-    def call_graph_with_retry(self, url: str, max_retries: int = MAX_RETRIES) -> Dict:
-        """Call Microsoft Graph API with exponential backoff retry logic."""
+    def _cache_get(self, key: str) -> Optional[Tuple[Optional[str], bytes, int]]:
+        """Return the cached (etag, body, fetched_at) row for a key, if any."""
+        with self._cache_lock:
+            return self._cache.execute(
+                "SELECT etag, body, fetched_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+    
+    def _cache_put(self, key: str, etag: Optional[str], body: bytes) -> None:
+        """Store or refresh a cached response body."""
+        with self._cache_lock:
+            self._cache.execute(
+                "INSERT INTO responses (key, etag, body, fetched_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET etag = excluded.etag, body = excluded.body, "
+                "fetched_at = excluded.fetched_at",
+                (key, etag, body, int(time.time()))
+            )
+            self._cache.commit()
+    
+    def _record_host_error(self, url: str) -> int:
+        """Count a failed request to the URL's host and return the earlier failure streak.
+
+        Retries use the larger of their own attempt number and this streak
+        as the backoff exponent, so a worker that starts calling a failing
+        host backs off as far as the workers already retrying against it.
+        """
+        host = urlparse(url).netloc
+        with self._host_lock:
+            streak = self._host_errors.get(host, 0)
+            self._host_errors[host] = streak + 1
+        return streak
+    
+    def _clear_host_errors(self, url: str) -> None:
+        """Reset the failure streak of the URL's host after a good response."""
+        with self._host_lock:
+            self._host_errors.pop(urlparse(url).netloc, None)
+    
+    def _request_with_retry(self, url: str, max_retries: int = MAX_RETRIES, payload: Optional[Dict] = None,
+                            headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Send a Graph request through the rate limits with exponential backoff retry logic.
+
+        Issues a GET, or a POST with ``payload`` as the JSON body when given.
+        Throttled (429), failed (5xx) and unsent requests are retried; the
+        final response is returned, or the error raised once retries run out.
+        Other client errors (4xx) are raised straight away.
+        A 304 is returned as is for conditional requests.
+        """
         for attempt in range(max_retries + 1):
             try:
-                response = self.session.get(url)
+                self.rate_limit.wait()
+                self.bucket.acquire()
+                self.throttle.acquire()
+                started = time.monotonic()
+                status = 0
+                try:
+                    if payload is None:
+                        response = self.session.get(url, headers=headers, timeout=GRAPH_TIMEOUT)
+                    else:
+                        response = self.session.post(url, json=payload, timeout=GRAPH_TIMEOUT)
+                    status = response.status_code
+                    self.rate_limit.update(response.headers)
+                finally:
+                    self.throttle.release(status, time.monotonic() - started)
                 
-                if response.status_code == 429:  # Rate limit
-                    retry_after = int(response.headers.get('Retry-After', BASE_DELAY * (2 ** attempt)))
-                    logger.warning(f"Rate limited. Waiting {retry_after} seconds...")
-                    time.sleep(retry_after)
+                if response.status_code == 429 and attempt < max_retries:  # Rate limit
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if retry_after is None:
+                        retry_after = backoff_delay(attempt)
+                    logger.warning(f"Rate limited. Waiting {retry_after:.1f} seconds...")
+                    # Every worker waits in bucket.acquire() before its next request
+                    self.bucket.drain(retry_after)
                     continue
                     
-                elif response.status_code >= 500:  # Server error
-                    delay = BASE_DELAY * (2 ** attempt)
-                    logger.warning(f"Server error {response.status_code}. Retrying in {delay} seconds...")
+                elif response.status_code >= 500 and attempt < max_retries:  # Server error
+                    streak = self._record_host_error(url)
+                    delay = parse_retry_after(response.headers.get('Retry-After'))
+                    if delay is None:
+                        delay = backoff_delay(max(attempt, streak))
+                    logger.warning(f"Server error {response.status_code}. Retrying in {delay:.1f} seconds...")
                     time.sleep(delay)
                     continue
-                    
-                response.raise_for_status()
-                return response.json()
                 
+                if response.status_code < 500 and response.status_code != 429:
+                    self._clear_host_errors(url)
+                if response.status_code != 304:
+                    response.raise_for_status()
+                return response
+                
+            except requests.exceptions.HTTPError:
+                # Throttling and server errors were retried above; a client error
+                # such as a missing page or a rejected query will not change
+                raise
             except requests.exceptions.RequestException as e:
                 if attempt == max_retries:
                     logger.error(f"Failed to call Graph API after {max_retries} retries: {e}")
                     raise
-                delay = BASE_DELAY * (2 ** attempt)
-                logger.warning(f"Request failed: {e}. Retrying in {delay} seconds...")
+                delay = backoff_delay(max(attempt, self._record_host_error(url)))
+                logger.warning(f"Request failed: {e}. Retrying in {delay:.1f} seconds...")
                 time.sleep(delay)
     
-    def call_graph_paginated(self, url: str) -> List[Dict]:
-        """Call Microsoft Graph API and handle pagination."""
-        data = self.call_graph_with_retry(url)
-        results = data.get("value", [])
+    def call_graph_with_retry(self, url: str, max_retries: int = MAX_RETRIES, payload: Optional[Dict] = None) -> Dict:
+        """Call Microsoft Graph API and decode the JSON response.
+
+        Requests go through _request_with_retry. With a response cache
+        configured, GET responses that carried an ETag are stored per signed-in
+        account and every later request for them is sent with If-None-Match;
+        a 304 replays the stored body. Nothing is served without asking
+        Graph, so new and edited pages always show up in the listings.
+        """
+        cache_key = None
+        cached = None
+        headers = None
+        if self._cache is not None and payload is None and self.account_id:
+            cache_key = hashlib.sha1(f"{self.account_id}\n{url}".encode('utf-8')).hexdigest()
+            cached = self._cache_get(cache_key)
+            if cached and cached[0]:
+                headers = {"If-None-Match": cached[0]}
+        
+        response = self._request_with_retry(url, max_retries, payload, headers)
+        if response.status_code == 304 and cached:
+            self._cache_put(cache_key, cached[0], cached[1])
+            return _json_loads(cached[1])
+        
+        etag = response.headers.get('ETag') if cache_key is not None else None
+        if etag:
+            self._cache_put(cache_key, etag, response.content)
+        return _json_loads(response.content)
+    
+    def call_graph_paginated(self, url: str) -> Iterator[Dict]:
+        """Call Microsoft Graph API and yield items across all result pages.
+
+        The next page is only requested once the current one is consumed, so
+        at most one page of items is held at a time.
+        """
+        while url:
+            data = self.call_graph_with_retry(url)
+            yield from data.get("value", [])
+            url = data.get("@odata.nextLink")
+            if url:
+                logger.info("Fetching next page...")
+    
+    def call_graph_batch(self, sub_requests: List[Dict], max_retries: int = MAX_RETRIES) -> List[Dict]:
+        """Send up to MAX_BATCH_SIZE GET requests as one Graph $batch call.
+
+        Each entry needs a ``url``, absolute or relative to the API root, and
+        may carry ``headers``. The sub-responses are returned in the same
+        order as ``sub_requests``. Sub-requests that come back throttled
+        (429), with a server error or with a failed dependency (424) are
+        re-sent in a follow-up batch. Use BatchedGraphClient for longer lists.
+        """
+        if len(sub_requests) > MAX_BATCH_SIZE:
+            raise ValueError(f"$batch accepts at most {MAX_BATCH_SIZE} requests, got {len(sub_requests)}")
         
-        # Handle pagination
-        while "@odata.nextLink" in data:
-            logger.info("Fetching next page...")
-            data = self.call_graph_with_retry(data["@odata.nextLink"])
-            results.extend(data.get("value", []))
+        envelopes = []
+        for index, sub_request in enumerate(sub_requests):
+            url = sub_request["url"]
+            if url.startswith(GRAPH_ROOT):
+                url = url[len(GRAPH_ROOT):]
+            envelope = {"id": str(index), "method": "GET", "url": url}
+            if sub_request.get("headers"):
+                envelope["headers"] = sub_request["headers"]
+            envelopes.append(envelope)
+        
+        responses = {}
+        pending = envelopes
+        for attempt in range(max_retries + 1):
+            retry = []
+            retry_after = 0
+            data = self.call_graph_with_retry(BATCH_URL, payload={"requests": pending})
+            by_id = {envelope["id"]: envelope for envelope in pending}
+            for response in data.get("responses", []):
+                responses[response["id"]] = response
+                status = response.get("status", 0)
+                if status in (424, 429) or status >= 500:
+                    retry.append(by_id[response["id"]])
+                    header = parse_retry_after(response.get("headers", {}).get("Retry-After"))
+                    if header is not None:
+                        retry_after = max(retry_after, header)
             
+            if not retry or attempt == max_retries:
+                break
+            delay = retry_after or backoff_delay(attempt)
+            logger.warning(f"{len(retry)} batched requests throttled or failed. Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            pending = retry
+        
+        return [responses.get(envelope["id"], {"id": envelope["id"], "status": 0, "body": None}) for envelope in envelopes]
+    
+    def _batch_values(self, response: Dict) -> List[Dict]:
+        """Return the items of a batched collection response, following pagination."""
+        if response.get("status") != 200:
+            logger.error(f"Batched request failed with status {response.get('status')}: {response.get('body')}")
+            return []
+        body = response.get("body") or {}
+        results = body.get("value", [])
+        if "@odata.nextLink" in body:
+            results.extend(self.call_graph_paginated(body["@odata.nextLink"]))
         return results
     
+    @staticmethod
+    def _batch_text(response: Dict) -> Optional[str]:
+        """Return the body of a batched non-JSON response as text.
+
+        Graph base64-encodes non-JSON bodies inside batch responses, but may
+        also inline them as plain strings.
+        """
+        body = response.get("body")
+        if response.get("status") != 200 or not isinstance(body, str):
+            return None
+        try:
+            return base64.b64decode(body, validate=True).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return body
+    
+    def _media_index(self, output_path: pathlib.Path) -> Dict[str, Dict]:
+        """Return the record of media previously downloaded into output_path."""
+        with self._media_lock:
+            index = self._media_indexes.get(output_path)
+            if index is None:
+                try:
+                    index = _json_loads((output_path / MEDIA_INDEX_FILE).read_bytes())
+                except (OSError, ValueError):
+                    index = {}
+                self._media_indexes[output_path] = index
+            return index
+    
+    def save_media_indexes(self) -> None:
+        """Write the media records so the next run can skip unchanged files."""
+        with self._media_lock:
+            for output_path, index in self._media_indexes.items():
+                try:
+                    (output_path / MEDIA_INDEX_FILE).write_text(json.dumps(index, indent=2), encoding='utf-8')
+                except OSError as e:
+                    logger.warning(f"Failed to save media index in {output_path}: {e}")
+    
     def download_media(self, media_url: str, output_path: pathlib.Path) -> str:
-        """Download media file and return local filename."""
+        """Download media file and return local filename.
+
+        Concurrent and repeated calls for the same URL share one download.
+        Callers saving into another directory get a hard link to the first
+        file, or a copy where linking is not possible. Failed downloads are
+        forgotten so a later call can try again.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(media_url)
+            owner = future is None
+            if owner:
+                future = self._inflight[media_url] = Future()
+        
+        if owner:
+            filename = ""
+            try:
+                filename = self._fetch_media(media_url, output_path)
+            finally:
+                if not filename:
+                    with self._inflight_lock:
+                        self._inflight.pop(media_url, None)
+                future.set_result((output_path, filename))
+            return filename
+        
+        source_path, filename = future.result()
+        if not filename or source_path == output_path:
+            return filename
+        return self._link_media(media_url, source_path, output_path, filename)
+    
+    def _link_media(self, media_url: str, source_path: pathlib.Path, output_path: pathlib.Path, filename: str) -> str:
+        """Make a media file downloaded into ``source_path`` available in ``output_path``."""
+        target = output_path / filename
+        try:
+            if not target.exists():
+                try:
+                    os.link(source_path / filename, target)
+                except OSError:
+                    shutil.copyfile(source_path / filename, target)
+        except OSError as e:
+            logger.error(f"Failed to copy media {filename} to {output_path}: {e}")
+            return ""
+        
+        source_index = self._media_index(source_path)
+        index = self._media_index(output_path)
+        with self._media_lock:
+            index[media_url] = {"filename": filename, "etag": source_index.get(media_url, {}).get("etag")}
+        logger.info(f"Linked media: {filename}")
+        return filename
+    
+    def _fetch_media(self, media_url: str, output_path: pathlib.Path) -> str:
+        """Download a media file into ``output_path`` and return its filename.
+
+        Files recorded in the media index are reused: without an ETag they are
+        not requested again, otherwise a conditional GET is sent and a 304
+        keeps the existing file.
+        """
+        index = self._media_index(output_path)
+        cached = index.get(media_url)
+        headers = {}
+        if cached and (output_path / cached["filename"]).exists():
+            if not cached.get("etag"):
+                return cached["filename"]
+            headers["If-None-Match"] = cached["etag"]
+        
+        self.rate_limit.wait()
+        self.bucket.acquire()
+        self.throttle.acquire()
+        started = time.monotonic()
+        status = 0
         try:
-            response = self.session.get(media_url, stream=True)
+            response = self.session.get(media_url, stream=True, headers=headers, timeout=MEDIA_TIMEOUT)
+            status = response.status_code
+            self.rate_limit.update(response.headers)
+            if status == 304:
+                response.close()
+                logger.info(f"Media unchanged: {cached['filename']}")
+                return cached["filename"]
             response.raise_for_status()
             
+            content_length = response.headers.get('Content-Length')
+            if content_length and int(content_length) > MAX_MEDIA_SIZE:
+                response.close()
+                logger.warning(f"Skipping media larger than {MAX_MEDIA_SIZE} bytes: {media_url}")
+                return ""
+            
             # Extract filename from URL or use content-type
             parsed_url = urlparse(media_url)
             filename = os.path.basename(parsed_url.path)
             
             if not filename or '.' not in filename:
                 content_type = response.headers.get('content-type', '')
+                # Stable across runs, unlike hash(), so re-exports keep the same names
+                digest = hashlib.blake2b(media_url.encode('utf-8'), digest_size=8).hexdigest()
                 if 'image/' in content_type:
                     ext = content_type.split('/')[-1]
-                    filename = f"image_{hash(media_url) % 10000}.{ext}"
+                    filename = f"image_{digest}.{ext}"
                 else:
-                    filename = f"media_{hash(media_url) % 10000}.bin"
+                    filename = f"media_{digest}.bin"
             
             file_path = output_path / filename
             
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            response.raw.decode_content = True
+            head = response.raw.read(MEDIA_DEDUPE_BYTES)
+            content_key = (output_path, f"{hashlib.blake2b(head).hexdigest()}:{content_length}")
+            
+            # The same image embedded under different URLs is only stored once
+            with self._media_lock:
+                existing = self._media_by_content.get(content_key)
+            if existing and existing != filename and (output_path / existing).exists():
+                response.close()
+                with self._media_lock:
+                    index[media_url] = {"filename": existing, "etag": response.headers.get('ETag')}
+                logger.info(f"Reusing identical media: {existing}")
+                return existing
+            
+            # Content-Length may be missing, so the size limit is enforced while copying too.
+            # Writing to a .part file first means an interrupted download never
+            # leaves a truncated image under the final name.
+            part_path = file_path.with_name(file_path.name + '.part')
+            written = len(head)
+            try:
+                with open(part_path, 'wb') as f:
+                    f.write(head)
+                    while written <= MAX_MEDIA_SIZE:
+                        chunk = response.raw.read(MEDIA_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        written += len(chunk)
+                if written > MAX_MEDIA_SIZE:
+                    response.close()
+                    logger.warning(f"Skipping media larger than {MAX_MEDIA_SIZE} bytes: {media_url}")
+                    return ""
+                os.replace(part_path, file_path)
+            finally:
+                if part_path.exists():
+                    part_path.unlink()
+            
+            with self._media_lock:
+                self._media_by_content[content_key] = filename
+                index[media_url] = {"filename": filename, "etag": response.headers.get('ETag')}
                     
             logger.info(f"Downloaded media: {filename}")
             return filename
@@ -150,111 +891,307 @@ class OneNoteExporter:
         except Exception as e:
             logger.error(f"Failed to download media {media_url}: {e}")
             return ""
+        finally:
+            self.throttle.release(status, time.monotonic() - started)
+    
+    def _download_all(self, urls: List[str], output_path: pathlib.Path) -> Dict[str, str]:
+        """Download media files concurrently and map each URL to its local filename.
+
+        Each distinct URL is downloaded once, however often it is embedded.
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        if not unique_urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=MEDIA_WORKERS) as executor:
+            futures = {url: executor.submit(self.download_media, url, output_path) for url in unique_urls}
+        return {url: future.result() for url, future in futures.items() if future.result()}
     
     def process_html_content(self, html: str, output_path: pathlib.Path) -> str:
         """Process HTML content, download media, and convert to Markdown."""
-        # Download embedded media
-        media_files = {}
-        img_pattern = r'<img[^>]+src=["\']([^"\']+)["\'][^>]*>'
-        
-        for match in re.finditer(img_pattern, html):
-            img_url = match.group(1)
-            if img_url.startswith('http'):
-                filename = self.download_media(img_url, output_path)
-                if filename:
-                    media_files[img_url] = filename
-                    # Replace URL with local filename
-                    html = html.replace(img_url, filename)
-        
-        # Convert HTML to Markdown
-        h2m = HTML2Text()
-        h2m.body_width = 0  # Don't wrap lines
-        h2m.ignore_images = False
-        h2m.ignore_emphasis = False
-        h2m.ignore_links = False
+        # Convert HTML to Markdown; html2text is pure Python, so during an
+        # export the conversion runs in worker processes to use every core
+        converted = None
+        if self._convert_pool is not None:
+            try:
+                converted = self._convert_pool.submit(convert_html, html).result()
+            except BrokenProcessPool as e:
+                logger.warning(f"Conversion worker failed, converting in-process: {e}")
+        markdown, placeholder_prefix, img_urls = converted or convert_html(html)
         
-        markdown = h2m.handle(html)
+        # Download embedded media and link it in place of the placeholders;
+        # images that failed to download keep their remote URL
+        if img_urls:
+            media_files = self._download_all(img_urls, output_path)
+            placeholder_re = re.compile(re.escape(placeholder_prefix) + r"(\d+)-")
+            
+            def link(match):
+                url = img_urls[int(match.group(1))]
+                return escape_md(media_files.get(url, url))
+            
+            markdown = placeholder_re.sub(link, markdown)
         
         return markdown
     
-    def export_page(self, page: Dict, section_path: pathlib.Path) -> None:
-        """Export a single OneNote page to Markdown."""
+    def _fetch_page_html(self, page_id: str) -> str:
+        """Fetch the HTML content of a single page.
+
+        Used when a batched content request failed, so it goes through the
+        same rate limits and retries as every other Graph call.
+        """
+        content_url = self._graph_url(f"/me/onenote/pages/{page_id}/content", top=None)
+        
+        response = self._request_with_retry(content_url, headers={"Accept": "text/html"})
+        return response.text
+    
+    def _start_convert_pool(self) -> None:
+        """Start the worker processes used for HTML to Markdown conversion.
+
+        Workers are only created on the first submit(), which happens on a
+        page thread while other threads hold locks. Forking then could copy a
+        held lock into the child, so workers come from a forkserver, or are
+        spawned where that is unavailable.
+        """
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        try:
+            self._convert_pool = ProcessPoolExecutor(max_workers=CONVERT_WORKERS, mp_context=context)
+        except (OSError, NotImplementedError) as e:
+            logger.warning(f"Process pool unavailable, converting pages in-process: {e}")
+    
+    def _stop_convert_pool(self) -> None:
+        if self._convert_pool is not None:
+            self._convert_pool.shutdown()
+            self._convert_pool = None
+    
+    def _page_file(self, page: Dict, section_path: pathlib.Path) -> pathlib.Path:
+        """Return the Markdown file a page is exported to."""
+        safe_title = self._sanitize_title(page.get("title", "Untitled"))
+        if not safe_title.strip():
+            safe_title = f"page_{page['id'][:8]}"
+        return section_path / f"{safe_title}.md"
+    
+    @staticmethod
+    def _is_up_to_date(page: Dict, md_file: pathlib.Path) -> bool:
+        """Check whether the exported file is newer than the page's last modification."""
+        modified = parse_graph_datetime(page.get("lastModifiedDateTime"))
+        if modified is None:
+            return False
         try:
-            # Get page content
-            page_id = page['id']
-            content_url = f"https://graph.microsoft.com/v1.0/me/onenote/pages/{page_id}/content"
+            return md_file.stat().st_mtime >= modified
+        except OSError:
+            return False
+    
+    def export_page(self, page: Dict, section_path: pathlib.Path, html_content: Optional[str] = None) -> None:
+        """Export a single OneNote page to Markdown.
+
+        The page HTML is fetched unless already supplied by a batched request.
+        Pages whose file is newer than their lastModifiedDateTime are skipped.
+        """
+        try:
+            page_title = page.get("title", "Untitled")
+            md_file = self._page_file(page, section_path)
+            if self._is_up_to_date(page, md_file):
+                logger.info(f"Page unchanged, skipping: {page_title}")
+                return
             
-            headers = {"Accept": "text/html"}
-            response = self.session.get(content_url, headers=headers)
-            response.raise_for_status()
-            html_content = response.text
+            if html_content is None:
+                html_content = self._fetch_page_html(page['id'])
             
             # Process content and convert to Markdown
             markdown_content = self.process_html_content(html_content, section_path)
             
-            # Create markdown file
-            page_title = page.get("title", "Untitled")
-            safe_title = re.sub(r'[<>:"/\\|?*]', '_', page_title)
-            if not safe_title.strip():
-                safe_title = f"page_{page_id[:8]}"
-                
-            md_file = section_path / f"{safe_title}.md"
-            
-            with open(md_file, 'w', encoding='utf-8') as f:
-                f.write(f"# {page_title}\n\n")
-                f.write(f"*Exported from OneNote on {time.strftime('%Y-%m-%d %H:%M:%S')}*\n\n")
-                f.write("---\n\n")
-                f.write(markdown_content)
+            header = (
+                f"# {page_title}\n\n"
+                f"*Exported from OneNote on {self.export_timestamp}*\n\n"
+                "---\n\n"
+            )
+            # The page body is encoded once and written as is, instead of first
+            # being copied into a combined header+body string. Both parts are
+            # encoded up front and written to a .part file that replaces the
+            # page only when complete, so a failure never leaves a truncated
+            # file whose fresh mtime would make the page look up to date.
+            header_bytes = header.encode('utf-8')
+            body_bytes = markdown_content.encode('utf-8')
+            part_file = md_file.with_name(md_file.name + '.part')
+            try:
+                with open(part_file, 'wb') as f:
+                    f.write(header_bytes)
+                    f.write(body_bytes)
+                os.replace(part_file, md_file)
+            finally:
+                if part_file.exists():
+                    part_file.unlink()
             
             logger.info(f"Exported page: {page_title}")
             
         except Exception as e:
             logger.error(f"Failed to export page {page.get('title', 'Unknown')}: {e}")
     
+    @staticmethod
+    def _sanitize_title(title: str) -> str:
+        """Replace characters that are not allowed in file names with underscores."""
+        return title.translate(_SAFE_TITLE_TRANS)
+    
+    def _ensure_dir(self, path: pathlib.Path) -> None:
+        """Create a directory once per run, skipping the mkdir for known paths."""
+        if path not in self._created_dirs:
+            path.mkdir(parents=True, exist_ok=True)
+            self._created_dirs.add(path)
+    
+    @staticmethod
+    def _graph_url(path: str, select: Optional[str] = None, top: Optional[int] = 100,
+                   expand: Optional[str] = None) -> str:
+        """Build a Graph URL that asks only for the given fields.
+
+        Graph keeps $select/$top in the nextLink it returns, so follow-up
+        pages stay trimmed as well.
+        """
+        query = []
+        if select:
+            query.append(f"$select={select}")
+        if expand:
+            query.append(f"$expand={expand}")
+        if top:
+            query.append(f"$top={top}")
+        url = f"{GRAPH_ROOT}{path}"
+        return f"{url}?{'&'.join(query)}" if query else url
+    
+    def _fill_expanded(self, parents: List[Dict], key: str, url_template: str) -> None:
+        """Make sure every parent carries its ``key`` collection.
+
+        Collections Graph did not expand inline are listed through $batch
+        using ``url_template``; truncated inline collections are paged in.
+        """
+        missing = [parent for parent in parents if key not in parent]
+        if missing:
+            batch = BatchedGraphClient(self)
+            for parent in missing:
+                batch.add(parent["id"], url_template.format(id=parent["id"]))
+            responses = batch.flush()
+            for parent in missing:
+                parent[key] = self._batch_values(responses[parent["id"]])
+        
+        for parent in parents:
+            next_link = parent.pop(f"{key}@odata.nextLink", None)
+            if next_link:
+                parent[key].extend(self.call_graph_paginated(next_link))
+    
+    def _list_notebooks(self) -> List[Dict]:
+        """List notebooks with as much of the hierarchy expanded as Graph accepts.
+
+        Graph only documents sections as expandable on notebooks, so if the
+        nested pages $expand is rejected with a client error (other than auth
+        or throttling) the listing is retried with shallower expansions; _fill_expanded then batches
+        whatever is missing.
+        """
+        expansions = (
+            "sections($select=id,displayName;$expand=pages($select=id,title,lastModifiedDateTime))",
+            "sections($select=id,displayName)",
+            None,
+        )
+        for expand in expansions:
+            try:
+                return list(self.call_graph_paginated(
+                    self._graph_url("/me/onenote/notebooks", select="id,displayName", expand=expand)
+                ))
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else 0
+                if expand is None or not 400 <= status < 500 or status in (401, 403, 429):
+                    raise
+                logger.warning(f"Graph rejected $expand={expand} ({status}), retrying with less expanded")
+    
     def export_notebooks(self) -> None:
-        """Main export function that walks through all notebooks, sections, and pages."""
+        """Main export function that walks through all notebooks, sections, and pages.
+
+        The notebook hierarchy is discovered with a single $expand query and
+        page content is fetched through $batch requests rather than one
+        round trip per page.
+        """
         try:
-            # Get all notebooks using the correct endpoint for personal accounts
+            # Every page of this run carries the same export time
+            self.export_timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            
+            # Get all notebooks with their sections and pages expanded inline
             logger.info("Fetching notebooks...")
-            notebooks = self.call_graph_paginated("https://graph.microsoft.com/v1.0/me/onenote/notebooks")
+            notebooks = self._list_notebooks()
             logger.info(f"Found {len(notebooks)} notebooks")
+            self._fill_expanded(notebooks, "sections",
+                                self._graph_url("/me/onenote/notebooks/{id}/sections", select="id,displayName"))
             
+            sections_by_path = []
             for notebook in notebooks:
                 notebook_name = notebook.get("displayName", "Untitled")
-                safe_notebook_name = re.sub(r'[<>:"/\\|?*]', '_', notebook_name)
+                safe_notebook_name = self._sanitize_title(notebook_name)
                 notebook_path = self.output_dir / safe_notebook_name
-                notebook_path.mkdir(parents=True, exist_ok=True)
-                
-                logger.info(f"Processing notebook: {notebook_name}")
+                self._ensure_dir(notebook_path)
                 
-                # Get sections for this notebook using the correct endpoint
-                sections_url = f"https://graph.microsoft.com/v1.0/me/onenote/notebooks/{notebook['id']}/sections"
-                sections = self.call_graph_paginated(sections_url)
+                sections = notebook["sections"]
                 logger.info(f"Found {len(sections)} sections in {notebook_name}")
                 
                 for section in sections:
                     section_name = section.get("displayName", "Untitled")
-                    safe_section_name = re.sub(r'[<>:"/\\|?*]', '_', section_name)
+                    safe_section_name = self._sanitize_title(section_name)
                     section_path = notebook_path / safe_section_name
-                    section_path.mkdir(parents=True, exist_ok=True)
-                    
+                    self._ensure_dir(section_path)
+                    sections_by_path.append((section, section_path))
+            
+            self._fill_expanded([section for section, _ in sections_by_path], "pages",
+                                self._graph_url("/me/onenote/sections/{id}/pages",
+                                                select="id,title,lastModifiedDateTime"))
+            
+            # Page threads handle I/O and hand the HTML to conversion processes
+            self._start_convert_pool()
+            with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+                pending = []
+                for section, section_path in sections_by_path:
+                    section_name = section.get("displayName", "Untitled")
                     logger.info(f"Processing section: {section_name}")
                     
-                    # Get pages for this section using the correct endpoint
-                    pages_url = f"https://graph.microsoft.com/v1.0/me/onenote/sections/{section['id']}/pages"
-                    pages = self.call_graph_paginated(pages_url)
-                    logger.info(f"Found {len(pages)} pages in {section_name}")
+                    # Unchanged pages need neither their content nor their media fetched
+                    pages = [page for page in section["pages"]
+                             if not self._is_up_to_date(page, self._page_file(page, section_path))]
+                    logger.info(f"Found {len(section['pages'])} pages in {section_name}, "
+                                f"{len(pages)} changed since the last export")
                     
-                    for page in pages:
-                        self.export_page(page, section_path)
+                    # Fetch page content one batch at a time; the previous batch is
+                    # exported by the workers while the next one is downloading
+                    for start in range(0, len(pages), MAX_BATCH_SIZE):
+                        chunk = pages[start:start + MAX_BATCH_SIZE]
+                        try:
+                            contents = self.call_graph_batch([
+                                {"url": self._graph_url(f"/me/onenote/pages/{page['id']}/content", top=None),
+                                 "headers": {"Accept": "text/html"}}
+                                for page in chunk
+                            ])
+                        except requests.exceptions.RequestException as e:
+                            # export_page fetches each page on its own instead
+                            logger.warning(f"Batched content fetch failed, fetching pages one by one: {e}")
+                            contents = [{} for _ in chunk]
+                        for future in pending:
+                            future.result()
+                        pending = [
+                            executor.submit(self.export_page, page, section_path, self._batch_text(content))
+                            for page, content in zip(chunk, contents)
+                        ]
+                
+                for future in pending:
+                    future.result()
                         
         except Exception as e:
             logger.error(f"Export failed: {e}")
             raise
+        finally:
+            self._stop_convert_pool()
+            self.save_media_indexes()
 
 
 def main():
     """Main entry point."""
+    parser = argparse.ArgumentParser(description="Export OneNote notebooks to Markdown")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="do not keep or revalidate cached Graph listings")
+    args = parser.parse_args()
+    
     if CLIENT_ID == "YOUR_CLIENT_ID_HERE":
         print("ERROR: Please set ONENOTE_CLIENT_ID environment variable or replace YOUR_CLIENT_ID_HERE with your actual Azure AD application client ID.")
         print("\nTo get a client ID:")
@@ -268,7 +1205,8 @@ def main():
         sys.exit(1)
     
     try:
-        exporter = OneNoteExporter(CLIENT_ID, SCOPES, OUTPUT_DIR)
+        cache_path = None if args.no_cache else OUTPUT_DIR / RESPONSE_CACHE_FILE
+        exporter = OneNoteExporter(CLIENT_ID, SCOPES, OUTPUT_DIR, cache_path=cache_path)
         exporter.get_token()
         exporter.export_notebooks()
         logger.info("Export completed successfully!")
@@ -8,22 +8,49 @@ For personal Microsoft accounts, we need to use the OneNote Web API instead of M
 import os
 import sys
 import json
+import hashlib
 import requests
 import pathlib
 import time
 import re
+import random
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import urljoin, urlparse
 from typing import Dict, List, Optional, Tuple
 from msal import PublicClientApplication
 from html2text import HTML2Text
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library parser is the fallback
+    orjson = None
+
 # Configuration
 CLIENT_ID = os.getenv("ONENOTE_CLIENT_ID", "YOUR_CLIENT_ID_HERE")  # Set via environment variable or replace with your Azure AD app registration client ID
 SCOPES = ["Notes.Read", "User.Read"]
 OUTPUT_DIR = pathlib.Path("output")
 MAX_RETRIES = 3
 BASE_DELAY = 1  # seconds
+MAX_DELAY = 30  # cap for computed backoff delays, in seconds
+MEDIA_WORKERS = 8  # concurrent media downloads per page
+MAX_MEDIA_SIZE = 10 * 1024 * 1024  # 10MB maximum file size for media downloads
+MEDIA_CHUNK_SIZE = 256 * 1024  # bytes copied per read when saving media
+POOL_CONNECTIONS = 32  # number of per-host connection pools to keep
+POOL_MAXSIZE = 64  # keep-alive connections kept open per host
+
+# Options applied to every HTML2Text converter
+HTML2TEXT_CONFIG = {
+    "body_width": 0,  # Don't wrap lines
+    "ignore_images": False,
+    "ignore_emphasis": False,
+    "ignore_links": False,
+}
+
+_IMG_RE = re.compile(r'<img[^>]+src=["\']([^"\']+)["\'][^>]*>', re.IGNORECASE)
+_SAFE_TITLE_TRANS = str.maketrans({c: '_' for c in '<>:"/\\|?*'})  # characters not allowed in file names
 
 # Setup logging
 logging.basicConfig(
@@ -37,6 +64,60 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _json_loads(data: bytes):
+    """Decode a JSON response body, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def new_html2text() -> HTML2Text:
+    """Create an HTML2Text converter configured from HTML2TEXT_CONFIG.
+
+    html2text keeps per-document parser state (open lists, tables, <pre>
+    blocks, links) on the instance, so each page gets a fresh converter.
+    """
+    h2m = HTML2Text()
+    for option, value in HTML2TEXT_CONFIG.items():
+        setattr(h2m, option, value)
+    return h2m
+
+
+def create_session() -> requests.Session:
+    """Create the HTTP session shared by every request of an export.
+
+    Requests stay on HTTP/1.1 through requests; instead of multiplexing, a
+    large keep-alive pool lets concurrent requests reuse TLS connections.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+
+def backoff_delay(attempt: int) -> float:
+    """Return a full-jitter exponential backoff delay for the given attempt."""
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given as delta-seconds or as an HTTP-date."""
+    if value is None:
+        return None
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
 class OneNoteWebExporter:
     """OneNote exporter using Web API for personal accounts."""
     
@@ -45,7 +126,7 @@ class OneNoteWebExporter:
         self.scopes = scopes
         self.output_dir = output_dir
         self.token = None
-        self.session = requests.Session()
+        self.session = create_session()
         
     def get_token(self) -> str:
         """Authenticate using device code flow and return access token."""
@@ -78,26 +159,30 @@ class OneNoteWebExporter:
                 response = self.session.get(url)
                 
                 if response.status_code == 429:  # Rate limit
-                    retry_after = int(response.headers.get('Retry-After', BASE_DELAY * (2 ** attempt)))
-                    logger.warning(f"Rate limited. Waiting {retry_after} seconds...")
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if retry_after is None:
+                        retry_after = backoff_delay(attempt)
+                    logger.warning(f"Rate limited. Waiting {retry_after:.1f} seconds...")
                     time.sleep(retry_after)
                     continue
                     
                 elif response.status_code >= 500:  # Server error
-                    delay = BASE_DELAY * (2 ** attempt)
-                    logger.warning(f"Server error {response.status_code}. Retrying in {delay} seconds...")
+                    delay = parse_retry_after(response.headers.get('Retry-After'))
+                    if delay is None:
+                        delay = backoff_delay(attempt)
+                    logger.warning(f"Server error {response.status_code}. Retrying in {delay:.1f} seconds...")
                     time.sleep(delay)
                     continue
                     
                 response.raise_for_status()
-                return response.json()
+                return _json_loads(response.content)
                 
             except requests.exceptions.RequestException as e:
                 if attempt == max_retries:
                     logger.error(f"Failed to call API after {max_retries} retries: {e}")
                     raise
-                delay = BASE_DELAY * (2 ** attempt)
-                logger.warning(f"Request failed: {e}. Retrying in {delay} seconds...")
+                delay = backoff_delay(attempt)
+                logger.warning(f"Request failed: {e}. Retrying in {delay:.1f} seconds...")
                 time.sleep(delay)
     
     def download_media(self, media_url: str, output_path: pathlib.Path) -> str:
@@ -106,23 +191,43 @@ class OneNoteWebExporter:
             response = self.session.get(media_url, stream=True)
             response.raise_for_status()
             
+            content_length = response.headers.get('Content-Length')
+            if content_length and int(content_length) > MAX_MEDIA_SIZE:
+                response.close()
+                logger.warning(f"Skipping media larger than {MAX_MEDIA_SIZE} bytes: {media_url}")
+                return ""
+            
             # Extract filename from URL or use content-type
             parsed_url = urlparse(media_url)
             filename = os.path.basename(parsed_url.path)
             
             if not filename or '.' not in filename:
                 content_type = response.headers.get('content-type', '')
+                # Stable across runs, unlike hash(), so re-exports keep the same names
+                digest = hashlib.blake2b(media_url.encode('utf-8'), digest_size=8).hexdigest()
                 if 'image/' in content_type:
                     ext = content_type.split('/')[-1]
-                    filename = f"image_{hash(media_url) % 10000}.{ext}"
+                    filename = f"image_{digest}.{ext}"
                 else:
-                    filename = f"media_{hash(media_url) % 10000}.bin"
+                    filename = f"media_{digest}.bin"
             
             file_path = output_path / filename
             
+            response.raw.decode_content = True
+            # Content-Length may be missing, so the size limit is enforced while copying too
+            written = 0
             with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
+                while written <= MAX_MEDIA_SIZE:
+                    chunk = response.raw.read(MEDIA_CHUNK_SIZE)
+                    if not chunk:
+                        break
                     f.write(chunk)
+                    written += len(chunk)
+            if written > MAX_MEDIA_SIZE:
+                response.close()
+                file_path.unlink()
+                logger.warning(f"Skipping media larger than {MAX_MEDIA_SIZE} bytes: {media_url}")
+                return ""
                     
             logger.info(f"Downloaded media: {filename}")
             return filename
@@ -131,29 +236,33 @@ class OneNoteWebExporter:
             logger.error(f"Failed to download media {media_url}: {e}")
             return ""
     
+    def _download_all(self, urls: List[str], output_path: pathlib.Path) -> Dict[str, str]:
+        """Download media files concurrently and map each URL to its local filename.
+
+        Each distinct URL is downloaded once, however often it is embedded.
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        if not unique_urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=MEDIA_WORKERS) as executor:
+            futures = {url: executor.submit(self.download_media, url, output_path) for url in unique_urls}
+        return {url: future.result() for url, future in futures.items() if future.result()}
+    
     def process_html_content(self, html: str, output_path: pathlib.Path) -> str:
         """Process HTML content, download media, and convert to Markdown."""
         # Download embedded media
-        media_files = {}
-        img_pattern = r'<img[^>]+src=["\']([^"\']+)["\'][^>]*>'
+        img_urls = [url for url in _IMG_RE.findall(html) if url.startswith('http')]
+        media_files = self._download_all(img_urls, output_path)
         
-        for match in re.finditer(img_pattern, html):
-            img_url = match.group(1)
-            if img_url.startswith('http'):
-                filename = self.download_media(img_url, output_path)
-                if filename:
-                    media_files[img_url] = filename
-                    # Replace URL with local filename
-                    html = html.replace(img_url, filename)
+        # Replace URLs with local filenames in a single pass
+        if media_files:
+            html = _IMG_RE.sub(
+                lambda m: m.group(0).replace(m.group(1), media_files[m.group(1)]) if m.group(1) in media_files else m.group(0),
+                html
+            )
         
         # Convert HTML to Markdown
-        h2m = HTML2Text()
-        h2m.body_width = 0  # Don't wrap lines
-        h2m.ignore_images = False
-        h2m.ignore_emphasis = False
-        h2m.ignore_links = False
-        
-        markdown = h2m.handle(html)
+        markdown = new_html2text().handle(html)
         
         return markdown
     
@@ -170,9 +279,9 @@ class OneNoteWebExporter:
             markdown_content = self.process_html_content(html_content, section_path)
             
             # Create markdown file
-            safe_title = re.sub(r'[<>:"/\\|?*]', '_', page_title)
+            safe_title = page_title.translate(_SAFE_TITLE_TRANS)
             if not safe_title.strip():
-                safe_title = f"page_{hash(page_url) % 10000}"
+                safe_title = f"page_{hashlib.blake2b(page_url.encode('utf-8'), digest_size=8).hexdigest()}"
                 
             md_file = section_path / f"{safe_title}.md"
             
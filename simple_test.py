@@ -4,35 +4,24 @@ Simple test for OneNote API access
 """
 
 import os
-import requests
-from msal import PublicClientApplication
+
+from graph_probe import get_app, acquire_token, probe_session, batch_get
 
 CLIENT_ID = os.getenv("ONENOTE_CLIENT_ID", "YOUR_CLIENT_ID_HERE")  # Set via environment variable or replace with your Azure AD app registration client ID
 SCOPES = ["Notes.Read", "User.Read"]
 
 def test_onenote():
     """Test OneNote API access."""
-    
     print("🔍 Testing OneNote API access for personal accounts...")
     print("Based on Microsoft documentation: https://learn.microsoft.com/en-us/graph/api/resources/onenote-api-overview?view=graph-rest-1.0")
     print()
     
-    # Initialize the app
-    app = PublicClientApplication(CLIENT_ID, authority="https://login.microsoftonline.com/consumers")
+    app = get_app(CLIENT_ID)
     
-    # Get device flow
-    flow = app.initiate_device_flow(scopes=SCOPES)
-    if not flow.get("user_code"):
-        print("❌ Device code flow failed")
+    result = acquire_token(app, SCOPES)
+    if result is None:
         return
     
-    print("📱 Please authenticate using the device code flow:")
-    print(flow["message"])
-    print()
-    
-    # Acquire token
-    result = app.acquire_token_by_device_flow(flow)
-    
     if "access_token" not in result:
         print(f"❌ Failed to acquire token: {result}")
         return
@@ -43,12 +32,19 @@ def test_onenote():
     print()
     
     # Test endpoints
-    headers = {"Authorization": f"Bearer {token}"}
+    session = probe_session(token)
+    
+    # Both tests go out in one $batch round trip
+    try:
+        responses = batch_get(session, {"user": "/me", "notebooks": "/me/onenote/notebooks"})
+    except Exception as e:
+        print(f"❌ Batch request failed: {e}")
+        return
     
     # Test 1: User.Read (should work)
     print("🔍 Test 1: User.Read permission...")
     try:
-        response = requests.get("https://graph.microsoft.com/v1.0/me", headers=headers)
+        response = responses["user"]
         if response.status_code == 200:
             user_data = response.json()
             print(f"   ✅ User.Read works! User: {user_data.get('displayName', 'Unknown')}")
@@ -63,7 +59,7 @@ def test_onenote():
     print("🔍 Test 2: OneNote notebooks...")
     print("   Endpoint: https://graph.microsoft.com/v1.0/me/onenote/notebooks")
     try:
-        response = requests.get("https://graph.microsoft.com/v1.0/me/onenote/notebooks", headers=headers)
+        response = responses["notebooks"]
         print(f"   Status: {response.status_code}")
         
         if response.status_code == 200:
@@ -4,30 +4,20 @@ Test script to check Microsoft Graph permissions
 """
 
 import os
-import requests
-from msal import PublicClientApplication
+
+from graph_probe import get_app, acquire_token, probe_session, batch_get
 
 CLIENT_ID = os.getenv("ONENOTE_CLIENT_ID", "YOUR_CLIENT_ID_HERE")  # Set via environment variable or replace with your Azure AD app registration client ID
 SCOPES = ["Notes.Read", "User.Read"]
 
 def test_permissions():
     """Test what permissions we have access to."""
+    app = get_app(CLIENT_ID)
     
-    # Initialize the app
-    app = PublicClientApplication(CLIENT_ID, authority="https://login.microsoftonline.com/consumers")
-    
-    # Get device flow
-    flow = app.initiate_device_flow(scopes=SCOPES)
-    if not flow.get("user_code"):
-        print("Device code flow failed")
+    result = acquire_token(app, SCOPES)
+    if result is None:
         return
     
-    print("Please authenticate using the device code flow:")
-    print(flow["message"])
-    
-    # Acquire token
-    result = app.acquire_token_by_device_flow(flow)
-    
     if "access_token" not in result:
         print(f"Failed to acquire token: {result}")
         return
@@ -38,12 +28,24 @@ def test_permissions():
     print(f"Token type: {result.get('token_type', 'Unknown')}")
     
     # Test different endpoints
-    headers = {"Authorization": f"Bearer {token}"}
+    session = probe_session(token)
+    
+    # The endpoint probes go out in one $batch round trip
+    try:
+        responses = batch_get(session, {
+            "user": "/me",
+            "notebooks": "/me/onenote/notebooks",
+            "sections": "/me/onenote/sections",
+            "pages": "/me/onenote/pages",
+        })
+    except Exception as e:
+        print(f"❌ Batch request failed: {e}")
+        return
     
     # Test User.Read
     print("\n🔍 Testing User.Read permission...")
     try:
-        response = requests.get("https://graph.microsoft.com/v1.0/me", headers=headers)
+        response = responses["user"]
         if response.status_code == 200:
             user_data = response.json()
             print(f"✅ User.Read works! User: {user_data.get('displayName', 'Unknown')}")
@@ -59,7 +61,7 @@ def test_permissions():
     try:
         # Test notebooks endpoint
         print("Testing /me/onenote/notebooks...")
-        response = requests.get("https://graph.microsoft.com/v1.0/me/onenote/notebooks", headers=headers)
+        response = responses["notebooks"]
         print(f"  Status: {response.status_code}")
         if response.status_code == 200:
             notebooks = response.json()
@@ -71,7 +73,7 @@ def test_permissions():
         
         # Test sections endpoint
         print("\nTesting /me/onenote/sections...")
-        response_sections = requests.get("https://graph.microsoft.com/v1.0/me/onenote/sections", headers=headers)
+        response_sections = responses["sections"]
         print(f"  Status: {response_sections.status_code}")
         if response_sections.status_code == 200:
             sections = response_sections.json()
@@ -81,7 +83,7 @@ def test_permissions():
             
         # Test pages endpoint
         print("\nTesting /me/onenote/pages...")
-        response_pages = requests.get("https://graph.microsoft.com/v1.0/me/onenote/pages", headers=headers)
+        response_pages = responses["pages"]
         print(f"  Status: {response_pages.status_code}")
         if response_pages.status_code == 200:
             pages = response_pages.json()
@@ -95,11 +97,10 @@ def test_permissions():
     # Test with different headers
     print("\n🔍 Testing with different headers...")
     try:
-        headers_with_accept = headers.copy()
-        headers_with_accept["Accept"] = "application/json"
-        headers_with_accept["Content-Type"] = "application/json"
+        headers_with_accept = {"Accept": "application/json", "Content-Type": "application/json"}
         
-        response = requests.get("https://graph.microsoft.com/v1.0/me/onenote/notebooks", headers=headers_with_accept)
+        # Sent on its own: $batch would carry these on the envelope, not the probe
+        response = session.get("https://graph.microsoft.com/v1.0/me/onenote/notebooks", headers=headers_with_accept)
         print(f"With Accept header: {response.status_code}")
         if response.status_code != 200:
             print(f"Response: {response.text}")
@@ -6,6 +6,8 @@ import pytest
 import json
 from unittest.mock import Mock, patch, MagicMock
 from pathlib import Path
+import io
+import time
 import tempfile
 import shutil
 
@@ -14,7 +16,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from onenote_exporter import OneNoteExporter
+from onenote_exporter import OneNoteExporter, Throttle, RateLimitWindow, TokenBucket, BatchedGraphClient, _body_html
 
 
 class TestOneNoteExporter:
@@ -27,7 +29,8 @@ class TestOneNoteExporter:
             exporter = OneNoteExporter(
                 client_id="test_client_id",
                 scopes=["Notes.Read.All"],
-                output_dir=Path(temp_dir)
+                output_dir=Path(temp_dir),
+                token_cache_path=Path(temp_dir) / "msal_cache.bin"
             )
             yield exporter
     
@@ -45,12 +48,22 @@ class TestOneNoteExporter:
         assert exporter.scopes == ["Notes.Read.All"]
         assert exporter.token is None
     
+    def test_create_session_pool(self):
+        """Test that the shared session mounts a large keep-alive pool."""
+        from onenote_exporter import create_session, POOL_MAXSIZE
+        
+        session = create_session()
+        adapter = session.get_adapter("https://graph.microsoft.com/v1.0/me")
+        assert adapter._pool_maxsize == POOL_MAXSIZE
+        assert session.headers["Connection"] == "keep-alive"
+    
     @patch('onenote_exporter.PublicClientApplication')
     def test_get_token_success(self, mock_app_class, exporter):
         """Test successful token acquisition."""
         # Mock the MSAL application
         mock_app = Mock()
         mock_app_class.return_value = mock_app
+        mock_app.get_accounts.return_value = []
         
         # Mock device flow
         mock_flow = {
@@ -64,7 +77,10 @@ class TestOneNoteExporter:
             "access_token": "test_token_123",
             "expires_in": 3600
         }
-        mock_app.acquire_token_by_device_flow.return_value = mock_result
+        # Like MSAL, record the new tokens in the cache passed to the app
+        mock_app.acquire_token_by_device_flow.side_effect = lambda flow: (
+            setattr(mock_app_class.call_args.kwargs["token_cache"], "has_state_changed", True) or mock_result
+        )
         
         # Mock session headers update
         exporter.session = Mock()
@@ -73,13 +89,72 @@ class TestOneNoteExporter:
         
         assert token == "test_token_123"
         assert exporter.token == "test_token_123"
-        exporter.session.headers.update.assert_called_with({"Authorization": "Bearer test_token_123"})
+        exporter.session.headers.update.assert_called_with({
+            "Authorization": "Bearer test_token_123",
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        })
+        assert exporter.token_cache_path.exists()
+        assert exporter.token_cache_path.stat().st_mode & 0o777 == 0o600
+    
+    @patch('onenote_exporter.PublicClientApplication')
+    def test_get_token_silent(self, mock_app_class, exporter):
+        """Test that a cached account skips the device code flow."""
+        mock_app = Mock()
+        mock_app_class.return_value = mock_app
+        mock_app.get_accounts.return_value = [{"username": "user@example.com"}]
+        mock_app.acquire_token_silent.return_value = {"access_token": "cached_token", "id_token_claims": {"oid": "oid-1"}}
+        
+        exporter.session = Mock()
+        
+        assert exporter.get_token() == "cached_token"
+        assert exporter.account_id == "oid-1"
+        mock_app.acquire_token_silent.assert_called_once_with(["Notes.Read.All"], account={"username": "user@example.com"})
+        mock_app.initiate_device_flow.assert_not_called()
+    
+    @patch('onenote_exporter.PublicClientApplication')
+    def test_get_token_silent_hit(self, mock_app_class, exporter):
+        """Test that an unchanged token cache is not rewritten."""
+        mock_app = Mock()
+        mock_app_class.return_value = mock_app
+        mock_app.get_accounts.return_value = [{"username": "user@example.com"}]
+        mock_app.acquire_token_silent.return_value = {"access_token": "cached_token"}
+        exporter.session = Mock()
+        exporter.token_cache_path = exporter.output_dir / "nested" / "msal.bin"
+        
+        exporter.get_token()
+        assert not exporter.token_cache_path.exists()
+        
+        # A refreshed token changes the cache, which is then saved
+        exporter.token = None
+        mock_app.acquire_token_silent.side_effect = lambda *args, **kwargs: (
+            setattr(mock_app_class.call_args.kwargs["token_cache"], "has_state_changed", True)
+            or {"access_token": "refreshed_token"}
+        )
+        assert exporter.get_token() == "refreshed_token"
+        assert exporter.token_cache_path.exists()
+    
+    def test_token_cache_file_handling(self, tmp_path):
+        """Test that a corrupt cache is ignored and an existing file is tightened to 0600."""
+        from token_cache import load_token_cache, save_token_cache
+        
+        path = tmp_path / "msal.bin"
+        path.write_text("not json", encoding='utf-8')
+        os.chmod(path, 0o644)
+        
+        cache = load_token_cache(path)
+        cache.has_state_changed = True
+        save_token_cache(cache, path)
+        
+        assert path.stat().st_mode & 0o777 == 0o600
+        assert load_token_cache(path).serialize() == cache.serialize()
     
     @patch('onenote_exporter.PublicClientApplication')
     def test_get_token_device_flow_failure(self, mock_app_class, exporter):
         """Test device flow failure."""
         mock_app = Mock()
         mock_app_class.return_value = mock_app
+        mock_app.get_accounts.return_value = []
         
         # Mock failed device flow
         mock_flow = {}
@@ -93,6 +168,7 @@ class TestOneNoteExporter:
         """Test token acquisition failure."""
         mock_app = Mock()
         mock_app_class.return_value = mock_app
+        mock_app.get_accounts.return_value = []
         
         # Mock successful device flow
         mock_flow = {
@@ -116,7 +192,7 @@ class TestOneNoteExporter:
         # Mock the session and response
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.json.return_value = {"value": [{"id": "1", "name": "test"}]}
+        mock_response.content = json.dumps({"value": [{"id": "1", "name": "test"}]}).encode()
         
         exporter.session = Mock()
         exporter.session.get.return_value = mock_response
@@ -126,6 +202,52 @@ class TestOneNoteExporter:
         assert result == {"value": [{"id": "1", "name": "test"}]}
         exporter.session.get.assert_called_once()
     
+    def test_call_graph_with_retry_without_orjson(self, exporter):
+        """Test that responses decode with the standard library when orjson is missing."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.content = json.dumps({"value": []}).encode()
+        
+        exporter.session = Mock()
+        exporter.session.get.return_value = mock_response
+        
+        with patch('onenote_exporter.orjson', None):
+            assert exporter.call_graph_with_retry("https://graph.microsoft.com/v1.0/test") == {"value": []}
+    
+    def test_call_graph_with_retry_response_cache(self, tmp_path):
+        """Test that cached GET responses are always revalidated, per account."""
+        exporter = OneNoteExporter("test_client_id", ["Notes.Read.All"], tmp_path,
+                                   token_cache_path=None, cache_path=tmp_path / "cache.sqlite")
+        exporter.account_id = "user-1"
+        url = "https://graph.microsoft.com/v1.0/me/onenote/notebooks"
+        
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {"ETag": '"v1"'}
+        mock_response.content = json.dumps({"value": [{"id": "nb1"}]}).encode()
+        not_modified = Mock()
+        not_modified.status_code = 304
+        not_modified.headers = {}
+        changed = Mock()
+        changed.status_code = 200
+        changed.headers = {"ETag": '"v2"'}
+        changed.content = json.dumps({"value": [{"id": "nb1"}, {"id": "nb2"}]}).encode()
+        
+        exporter.session = Mock()
+        exporter.session.get.side_effect = [mock_response, not_modified, changed, mock_response]
+        
+        assert exporter.call_graph_with_retry(url) == {"value": [{"id": "nb1"}]}
+        # Every later call asks Graph; a 304 replays the stored body
+        assert exporter.call_graph_with_retry(url) == {"value": [{"id": "nb1"}]}
+        assert exporter.session.get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+        assert exporter.call_graph_with_retry(url) == {"value": [{"id": "nb1"}, {"id": "nb2"}]}
+        
+        # Another account never sees the first account's entries
+        exporter.account_id = "user-2"
+        exporter.call_graph_with_retry(url)
+        assert exporter.session.get.call_args.kwargs["headers"] is None
+        assert exporter.session.get.call_count == 4
+    
     def test_call_graph_with_retry_rate_limit(self, exporter):
         """Test rate limit handling."""
         # Mock rate limit response, then success
@@ -135,16 +257,20 @@ class TestOneNoteExporter:
         
         mock_response_200 = Mock()
         mock_response_200.status_code = 200
-        mock_response_200.json.return_value = {"value": [{"id": "1"}]}
+        mock_response_200.content = json.dumps({"value": [{"id": "1"}]}).encode()
         
         exporter.session = Mock()
         exporter.session.get.side_effect = [mock_response_429, mock_response_200]
         
-        with patch('onenote_exporter.time.sleep') as mock_sleep:
+        with patch('onenote_exporter.time.sleep') as mock_sleep, \
+             patch.object(exporter.bucket, 'drain', wraps=exporter.bucket.drain) as mock_drain:
             result = exporter.call_graph_with_retry("https://graph.microsoft.com/v1.0/test")
             
             assert result == {"value": [{"id": "1"}]}
-            mock_sleep.assert_called_with(2)
+            mock_drain.assert_called_once_with(2)  # other workers hold off too
+            # The retry waited out the Retry-After plus one refill interval
+            assert 1.9 < mock_sleep.call_args.args[0] <= 2.1
+            assert exporter.bucket.tokens < 0
             assert exporter.session.get.call_count == 2
     
     def test_call_graph_with_retry_server_error(self, exporter):
@@ -152,20 +278,98 @@ class TestOneNoteExporter:
         # Mock server error response, then success
         mock_response_500 = Mock()
         mock_response_500.status_code = 500
+        mock_response_500.headers = {}
         
         mock_response_200 = Mock()
         mock_response_200.status_code = 200
-        mock_response_200.json.return_value = {"value": [{"id": "1"}]}
+        mock_response_200.content = json.dumps({"value": [{"id": "1"}]}).encode()
         
         exporter.session = Mock()
         exporter.session.get.side_effect = [mock_response_500, mock_response_200]
         
-        with patch('onenote_exporter.time.sleep') as mock_sleep:
+        with patch('onenote_exporter.time.sleep') as mock_sleep, \
+                patch('onenote_exporter.random.uniform', return_value=0.4) as mock_uniform:
             result = exporter.call_graph_with_retry("https://graph.microsoft.com/v1.0/test")
             
             assert result == {"value": [{"id": "1"}]}
-            mock_sleep.assert_called_with(1)  # BASE_DELAY
+            mock_uniform.assert_called_with(0, 1)  # full jitter up to BASE_DELAY
+            mock_sleep.assert_called_with(0.4)
             assert exporter.session.get.call_count == 2
+        assert exporter._host_errors == {}
+    
+    def test_call_graph_with_retry_host_backoff(self, exporter):
+        """Test that a host's failure streak carries over to new calls."""
+        mock_response_503 = Mock()
+        mock_response_503.status_code = 503
+        mock_response_503.headers = {}
+        mock_response_200 = Mock()
+        mock_response_200.status_code = 200
+        mock_response_200.content = b'{}'
+        
+        exporter.session = Mock()
+        exporter.session.get.side_effect = [mock_response_503, mock_response_503, mock_response_503, mock_response_200]
+        # Another worker already saw two failures from this host
+        exporter._host_errors["graph.microsoft.com"] = 2
+        
+        with patch('onenote_exporter.time.sleep'), \
+                patch('onenote_exporter.random.uniform', return_value=0.1) as mock_uniform:
+            exporter.call_graph_with_retry("https://graph.microsoft.com/v1.0/test")
+        
+        assert [c.args[1] for c in mock_uniform.call_args_list] == [4, 8, 16]
+    
+    def test_call_graph_with_retry_client_error_not_counted(self, exporter):
+        """Test that 4xx responses do not raise the host's backoff streak."""
+        import requests
+        
+        mock_response_404 = Mock(status_code=404, headers={})
+        mock_response_404.raise_for_status.side_effect = requests.exceptions.HTTPError("404", response=mock_response_404)
+        exporter.session = Mock()
+        exporter.session.get.return_value = mock_response_404
+        
+        with patch('onenote_exporter.time.sleep'), pytest.raises(requests.exceptions.HTTPError):
+            exporter.call_graph_with_retry("https://graph.microsoft.com/v1.0/me/onenote/pages/missing")
+        
+        assert exporter.session.get.call_count == 1
+        assert exporter._host_errors == {}
+    
+    def test_call_graph_retry_after_httpdate(self, exporter):
+        """Test that Retry-After given as an HTTP-date is honoured on 429 and 503."""
+        from email.utils import format_datetime
+        from datetime import datetime, timedelta, timezone
+        
+        retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=10), usegmt=True)
+        mock_response_429 = Mock()
+        mock_response_429.status_code = 429
+        mock_response_429.headers = {"Retry-After": retry_at}
+        mock_response_503 = Mock()
+        mock_response_503.status_code = 503
+        mock_response_503.headers = {"Retry-After": retry_at}
+        mock_response_200 = Mock()
+        mock_response_200.status_code = 200
+        mock_response_200.content = b'{"value": []}'
+        
+        exporter.session = Mock()
+        exporter.session.get.side_effect = [mock_response_429, mock_response_503, mock_response_200]
+        
+        with patch('onenote_exporter.time.sleep') as mock_sleep, \
+                patch.object(exporter.bucket, 'drain') as mock_drain:
+            assert exporter.call_graph_with_retry("https://graph.microsoft.com/v1.0/test") == {"value": []}
+        
+        assert 5 < mock_drain.call_args.args[0] <= 10
+        assert 5 < mock_sleep.call_args.args[0] <= 10
+    
+    def test_parse_retry_after(self):
+        """Test Retry-After parsing for delta-seconds and HTTP-date values."""
+        from email.utils import format_datetime
+        from datetime import datetime, timedelta, timezone
+        from onenote_exporter import parse_retry_after
+        
+        assert parse_retry_after("5") == 5
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("not a date") is None
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        assert 25 < parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
     
     def test_call_graph_paginated(self, exporter):
         """Test pagination handling."""
@@ -184,19 +388,82 @@ class TestOneNoteExporter:
             
             result = exporter.call_graph_paginated("https://graph.microsoft.com/v1.0/test")
             
-            assert result == [
+            # Nothing is fetched until the items are consumed
+            assert mock_call.call_count == 0
+            assert list(result) == [
                 {"id": "1", "name": "item1"},
                 {"id": "2", "name": "item2"}
             ]
             assert mock_call.call_count == 2
     
+    def test_graph_url(self):
+        """Test that listing URLs request only the needed fields."""
+        assert OneNoteExporter._graph_url("/me/onenote/pages", select="id,title") == \
+            "https://graph.microsoft.com/v1.0/me/onenote/pages?$select=id,title&$top=100"
+        assert OneNoteExporter._graph_url("/me/onenote/pages/1/content", top=None) == \
+            "https://graph.microsoft.com/v1.0/me/onenote/pages/1/content"
+    
+    def test_call_graph_batch(self, exporter):
+        """Test $batch ordering and re-queue of throttled sub-requests."""
+        sub_requests = [{"url": f"/me/onenote/sections/{i}/pages"} for i in range(20)]
+
+        def fake_batch(url, payload=None):
+            responses = []
+            for envelope in payload["requests"]:
+                if envelope["id"] == "3" and fake_batch.throttled:
+                    fake_batch.throttled = False
+                    responses.append({"id": "3", "status": 429, "headers": {"Retry-After": "1"}})
+                else:
+                    responses.append({"id": envelope["id"], "status": 200, "body": {"value": [envelope["url"]]}})
+            # Graph does not guarantee response order
+            return {"responses": list(reversed(responses))}
+        fake_batch.throttled = True
+
+        with patch.object(exporter, 'call_graph_with_retry', side_effect=fake_batch) as mock_call, \
+                patch('onenote_exporter.time.sleep') as mock_sleep:
+            results = exporter.call_graph_batch(sub_requests)
+
+        # One full batch, then one retry batch for the throttled request
+        assert [len(c.kwargs["payload"]["requests"]) for c in mock_call.call_args_list] == [20, 1]
+        mock_sleep.assert_called_once_with(1)
+        assert [r["body"]["value"][0] for r in results] == [r["url"] for r in sub_requests]
+
+        # Longer lists are split by BatchedGraphClient, not here
+        with pytest.raises(ValueError):
+            exporter.call_graph_batch(sub_requests + [{"url": "/me"}])
+
+    def test_batched_graph_client(self, exporter):
+        """Test that queued requests are sent in full batches and resolved by id."""
+        def fake_batch(sub_requests):
+            return [{"status": 200, "body": {"url": r["url"], "headers": r["headers"]}} for r in sub_requests]
+        
+        with patch.object(exporter, 'call_graph_batch', side_effect=fake_batch) as mock_batch:
+            batch = BatchedGraphClient(exporter)
+            for i in range(25):
+                batch.add(f"page-{i}", f"/me/onenote/pages/{i}/content", {"Accept": "text/html"})
+            # The first 20 were sent as soon as the batch filled up
+            assert mock_batch.call_count == 1
+            responses = batch.flush()
+        
+        assert mock_batch.call_count == 2
+        assert len(responses) == 25
+        assert responses["page-21"]["body"] == {"url": "/me/onenote/pages/21/content", "headers": {"Accept": "text/html"}}
+    
+    def test_batch_text_decodes_base64(self, exporter):
+        """Test decoding of non-JSON bodies embedded in batch responses."""
+        import base64
+        encoded = base64.b64encode(b"<html><body>Hi</body></html>").decode()
+        assert exporter._batch_text({"status": 200, "body": encoded}) == "<html><body>Hi</body></html>"
+        assert exporter._batch_text({"status": 200, "body": "<html></html>"}) == "<html></html>"
+        assert exporter._batch_text({"status": 404, "body": {"error": {}}}) is None
+
     def test_download_media_success(self, exporter):
         """Test successful media download."""
         # Mock successful download
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.headers = {"content-type": "image/jpeg"}
-        mock_response.iter_content.return_value = [b"fake_image_data"]
+        mock_response.raw = io.BytesIO(b"fake_image_data")
         
         exporter.session = Mock()
         exporter.session.get.return_value = mock_response
@@ -206,7 +473,96 @@ class TestOneNoteExporter:
             filename = exporter.download_media("https://example.com/image.jpg", output_path)
             
             assert filename == "image.jpg"
-            assert (output_path / filename).exists()
+            assert (output_path / filename).read_bytes() == b"fake_image_data"
+            assert not list(output_path.glob("*.part"))
+            assert exporter.session.get.call_args.kwargs["timeout"] == (5, 60)
+    
+    def test_download_media_reuses_cached_file(self, exporter):
+        """Test conditional re-download of media recorded in the index."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {"content-type": "image/png", "ETag": '"v1"'}
+        mock_response.raw = io.BytesIO(b"fake_image_data")
+        
+        mock_not_modified = Mock()
+        mock_not_modified.status_code = 304
+        mock_not_modified.headers = {}
+        
+        exporter.session = Mock()
+        exporter.session.get.side_effect = [mock_response, mock_not_modified]
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir)
+            filename = exporter.download_media("https://example.com/image.png", output_path)
+            exporter.save_media_indexes()
+            
+            # A fresh exporter picks the record up from disk
+            exporter._media_indexes.clear()
+            exporter._inflight.clear()
+            assert exporter.download_media("https://example.com/image.png", output_path) == filename
+            
+            assert exporter.session.get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+            assert (output_path / filename).read_bytes() == b"fake_image_data"
+    
+    def test_download_media_deduplicates_content(self, exporter):
+        """Test stable fallback names and reuse of identical media under other URLs."""
+        def make_response(data):
+            response = Mock()
+            response.status_code = 200
+            response.headers = {"content-type": "image/png"}
+            response.raw = io.BytesIO(data)
+            return response
+        
+        exporter.session = Mock()
+        exporter.session.get.side_effect = [make_response(b"same"), make_response(b"same"), make_response(b"other")]
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir)
+            first = exporter.download_media("https://graph.microsoft.com/v1.0/resources/a/$value", output_path)
+            second = exporter.download_media("https://graph.microsoft.com/v1.0/resources/b/$value", output_path)
+            third = exporter.download_media("https://graph.microsoft.com/v1.0/resources/c/$value", output_path)
+            
+            assert first.startswith("image_") and first.endswith(".png")
+            assert second == first
+            assert third != first
+            assert sorted(p.name for p in output_path.glob("*.png")) == sorted([first, third])
+    
+    def test_download_media_too_large(self, exporter):
+        """Test that media over MAX_MEDIA_SIZE is skipped before reading the body."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {"content-type": "image/jpeg", "Content-Length": str(11 * 1024 * 1024)}
+        
+        exporter.session = Mock()
+        exporter.session.get.return_value = mock_response
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir)
+            filename = exporter.download_media("https://example.com/image.jpg", output_path)
+            
+            assert filename == ""
+            assert not (output_path / "image.jpg").exists()
+            mock_response.close.assert_called_once()
+    
+    def test_download_media_too_large_without_content_length(self, exporter):
+        """Test that the size limit is enforced while streaming."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {"content-type": "image/jpeg"}
+        mock_response.raw = io.BytesIO(b"x" * 1024 * 1024)
+        
+        exporter.session = Mock()
+        exporter.session.get.return_value = mock_response
+        
+        with tempfile.TemporaryDirectory() as temp_dir, patch('onenote_exporter.MAX_MEDIA_SIZE', 200 * 1024):
+            output_path = Path(temp_dir)
+            filename = exporter.download_media("https://example.com/image.jpg", output_path)
+            
+            assert filename == ""
+            assert not (output_path / "image.jpg").exists()
+            assert not (output_path / "image.jpg.part").exists()
+            # Reading stopped at the first chunk past the limit
+            assert mock_response.raw.tell() < 1024 * 1024
     
     def test_download_media_failure(self, exporter):
         """Test media download failure."""
@@ -220,6 +576,43 @@ class TestOneNoteExporter:
             
             assert filename == ""
     
+    def test_download_media_dedup(self, exporter):
+        """Test that concurrent calls for one URL share a single download."""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        def slow_get(*args, **kwargs):
+            time.sleep(0.1)
+            mock_response = Mock()
+            mock_response.status_code = 200
+            mock_response.headers = {"content-type": "image/jpeg"}
+            mock_response.raw = io.BytesIO(b"fake_image_data")
+            return mock_response
+        
+        exporter.session = Mock()
+        exporter.session.get.side_effect = slow_get
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first, second = Path(temp_dir) / "a", Path(temp_dir) / "b"
+            first.mkdir()
+            second.mkdir()
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(exporter.download_media, "https://example.com/image.jpg", path)
+                           for path in (first, second)]
+            
+            assert [future.result() for future in futures] == ["image.jpg", "image.jpg"]
+            assert exporter.session.get.call_count == 1
+            assert (first / "image.jpg").read_bytes() == (second / "image.jpg").read_bytes() == b"fake_image_data"
+    
+    def test_download_all_deduplicates_urls(self, exporter):
+        """Test that repeated URLs are downloaded once and all map to the same file."""
+        urls = ["https://example.com/a.png", "https://example.com/b.png", "https://example.com/a.png"]
+        
+        with patch.object(exporter, 'download_media', side_effect=lambda url, path: url.rsplit('/', 1)[-1]) as mock_download:
+            mapping = exporter._download_all(urls, Path("."))
+        
+        assert mock_download.call_count == 2
+        assert mapping == {"https://example.com/a.png": "a.png", "https://example.com/b.png": "b.png"}
+    
     def test_process_html_content(self, exporter):
         """Test HTML to Markdown conversion with media processing."""
         html_content = """
@@ -241,8 +634,110 @@ class TestOneNoteExporter:
                 
                 assert "# Test Page" in markdown
                 assert "This is a test paragraph" in markdown
+                assert "![Test image](image_1234.jpg)" in markdown
                 mock_download.assert_called_once_with("https://example.com/image.jpg", output_path)
     
+    def test_process_html_content_duplicate_images(self, exporter):
+        """Test that an image embedded several times is downloaded once."""
+        html_content = (
+            '<p><img src="https://example.com/icon.png" alt="one"> text '
+            '<IMG SRC="https://example.com/icon.png" alt="two"></p>'
+            '<p><img src="https://example.com/icon.png" alt="three"></p>'
+        )
+        
+        with patch.object(exporter, 'download_media', return_value="icon.png") as mock_download:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                markdown = exporter.process_html_content(html_content, Path(temp_dir))
+        
+        assert mock_download.call_count == 1
+        assert markdown.count("(icon.png)") == 3
+    
+    def test_process_html_content_attribute_variants(self, exporter):
+        """Test image extraction with unquoted, reordered and entity-escaped src attributes."""
+        html_content = (
+            '<IMG alt="a" SRC=https://example.com/a.png>'
+            '<img data-id="1" src=\'https://example.com/b.png?x=1&amp;y=2\' />'
+            '<img src="data:image/png;base64,AAAA">'
+        )
+        mapping = {
+            "https://example.com/a.png": "a.png",
+            "https://example.com/b.png?x=1&y=2": "b.png",
+        }
+        
+        with patch.object(exporter, 'download_media', side_effect=lambda url, path: mapping[url]) as mock_download:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                markdown = exporter.process_html_content(html_content, Path(temp_dir))
+        
+        assert sorted(c.args[0] for c in mock_download.call_args_list) == sorted(mapping)
+        assert "![a](a.png)" in markdown
+        assert "](b.png)" in markdown
+    
+    def test_process_html_content_links_media_after_conversion(self, exporter):
+        """Test placeholder substitution for escaped filenames and failed downloads."""
+        html_content = (
+            '<img src="https://example.com/a.png" alt="a">'
+            '<img src="https://example.com/missing.png" alt="m">'
+        )
+        mapping = {"https://example.com/a.png": "photo (1).png", "https://example.com/missing.png": ""}
+        
+        with patch.object(exporter, 'download_media', side_effect=lambda url, path: mapping[url]):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                markdown = exporter.process_html_content(html_content, Path(temp_dir))
+        
+        assert "![a](photo \\(1\\).png)" in markdown
+        assert "![m](https://example.com/missing.png)" in markdown
+        assert "onenote-media-" not in markdown
+    
+    def test_process_html_content_isolated_pages(self, exporter):
+        """Test that unclosed tags on one page do not affect the next page."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir)
+            expected = exporter.process_html_content("<p>para</p><p>two</p>", output_path)
+            exporter.process_html_content("<pre>unterminated code", output_path)
+            assert exporter.process_html_content("<p>para</p><p>two</p>", output_path) == expected
+    
+    def test_process_html_content_body_only(self, exporter):
+        """Test that only the <body> is converted and the output is unchanged."""
+        page = ('<html><head><title>Page</title><style>p { color: red; }</style></head>'
+                '<body data-absolute-enabled="true"><h1>Title</h1><p>Text</p></body></html>')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir)
+            assert exporter.process_html_content(page, output_path) == \
+                exporter.process_html_content("<h1>Title</h1><p>Text</p>", output_path)
+    
+    def test_body_html_tag_case(self):
+        """Test that the body tags are found whatever their case."""
+        assert _body_html('<HTML><BODY class="x"><p>Text</p></BODY ></HTML>') == "<p>Text</p>"
+        assert _body_html("<html><body><p>Text</p>") == "<p>Text</p>"
+        assert _body_html("<p>Text</p>") == "<p>Text</p>"
+    
+    def test_start_convert_pool_avoids_fork(self, exporter):
+        """Test that conversion workers are not forked from the threaded parent."""
+        exporter._start_convert_pool()
+        try:
+            assert exporter._convert_pool._mp_context.get_start_method() in ("forkserver", "spawn")
+        finally:
+            exporter._stop_convert_pool()
+    
+    def test_process_html_content_in_process_pool(self, exporter):
+        """Test that conversion runs in the worker pool when one is started."""
+        from concurrent.futures import ProcessPoolExecutor
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir)
+            expected = exporter.process_html_content("<h1>Title</h1><ul><li>item</li></ul>", output_path)
+            
+            pool = Mock(wraps=ProcessPoolExecutor(max_workers=1))
+            exporter._convert_pool = pool
+            try:
+                markdown = exporter.process_html_content("<h1>Title</h1><ul><li>item</li></ul>", output_path)
+            finally:
+                exporter._stop_convert_pool()
+            
+            assert markdown == expected
+            pool.submit.assert_called_once()
+            assert exporter._convert_pool is None
+    
     def test_export_page(self, exporter):
         """Test page export functionality."""
         # Mock page data
@@ -271,6 +766,212 @@ class TestOneNoteExporter:
                 md_files = list(section_path.glob("*.md"))
                 assert len(md_files) == 1
                 assert "Test Page.md" in md_files[0].name
+                assert md_files[0].read_text(encoding='utf-8') == (
+                    f"# Test Page\n\n*Exported from OneNote on {exporter.export_timestamp}*\n\n---\n\n# Test Page\n\nContent"
+                )
+    
+    def test_export_page_failed_write_leaves_no_file(self, exporter):
+        """Test that a page that cannot be encoded leaves no partial file behind."""
+        page = {"id": "page_123", "title": "Test Page"}
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            section_path = Path(temp_dir)
+            # A lone surrogate cannot be encoded as UTF-8
+            with patch.object(exporter, 'process_html_content', return_value="bad \ud800 text"):
+                exporter.export_page(page, section_path, "<p>x</p>")
+            
+            assert list(section_path.iterdir()) == []
+    
+    def test_fetch_page_html_retries_throttled(self, exporter):
+        """Test that the single-page fallback is rate limited and retried."""
+        mock_response_429 = Mock(status_code=429, headers={"Retry-After": "3"})
+        mock_response_200 = Mock(status_code=200, headers={}, text="<p>Content</p>")
+        
+        exporter.session = Mock()
+        exporter.session.get.side_effect = [mock_response_429, mock_response_200]
+        
+        with patch.object(exporter.bucket, 'drain') as mock_drain:
+            assert exporter._fetch_page_html("page_123") == "<p>Content</p>"
+        
+        mock_drain.assert_called_once_with(3)
+        assert exporter.session.get.call_args.kwargs["headers"] == {"Accept": "text/html"}
+        assert exporter.session.get.call_args.kwargs["timeout"] == (5, 60)
+    
+    def test_export_page_skips_unmodified(self, exporter):
+        """Test that a page older than its exported file is not fetched again."""
+        page = {"id": "page_123", "title": "Test Page", "lastModifiedDateTime": "2024-01-01T12:00:00.1234567Z"}
+        exporter.session = Mock()
+        exporter.session.get.return_value = Mock(status_code=200, headers={}, text="<p>Content</p>")
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            section_path = Path(temp_dir)
+            md_file = section_path / "Test Page.md"
+            md_file.write_text("old export", encoding='utf-8')
+            
+            with patch.object(exporter, 'process_html_content', return_value="Content") as mock_process:
+                exporter.export_page(page, section_path)
+                exporter.session.get.assert_not_called()
+                assert md_file.read_text(encoding='utf-8') == "old export"
+                
+                # Once the page changes after the export it is fetched again
+                os.utime(md_file, (0, 0))
+                exporter.export_page(page, section_path)
+                exporter.session.get.assert_called_once()
+                mock_process.assert_called_once()
+    
+    def test_parse_graph_datetime(self):
+        """Test Graph timestamps with and without fractional seconds."""
+        from onenote_exporter import parse_graph_datetime
+        
+        assert parse_graph_datetime("1970-01-01T00:01:00Z") == 60
+        assert parse_graph_datetime("1970-01-01T00:01:00.5Z") == 60.5
+        assert parse_graph_datetime("1970-01-01T00:01:00.1234567Z") == pytest.approx(60.123456)
+        assert parse_graph_datetime("not a date") is None
+        assert parse_graph_datetime(None) is None
+    
+    def test_export_notebooks(self, exporter):
+        """Test batched listings when Graph does not expand sections and pages inline."""
+        notebooks = [{"id": "nb1", "displayName": "Notebook"}]
+
+        def fake_batch(sub_requests):
+            responses = []
+            for sub_request in sub_requests:
+                url, _, query = sub_request["url"].partition("?")
+                if not url.endswith("/content"):
+                    assert "$select=id," in query
+                if url.endswith("/sections"):
+                    body = {"value": [{"id": "s1", "displayName": "Section"}]}
+                elif url.endswith("/pages"):
+                    body = {"value": [{"id": "p1", "title": "One"}, {"id": "p2", "title": "Two"}]}
+                else:
+                    body = f"<html><body>{url}</body></html>"
+                responses.append({"status": 200, "body": body})
+            return responses
+
+        with patch.object(exporter, 'call_graph_paginated', return_value=notebooks), \
+                patch.object(exporter, 'call_graph_batch', side_effect=fake_batch), \
+                patch.object(exporter, 'export_page') as mock_export:
+            exporter.export_notebooks()
+
+        section_path = exporter.output_dir / "Notebook" / "Section"
+        assert section_path.is_dir()
+        exported = sorted((c.args[0]["id"], c.args[1], c.args[2]) for c in mock_export.call_args_list)
+        assert exported == [
+            ("p1", section_path, "<html><body>https://graph.microsoft.com/v1.0/me/onenote/pages/p1/content</body></html>"),
+            ("p2", section_path, "<html><body>https://graph.microsoft.com/v1.0/me/onenote/pages/p2/content</body></html>"),
+        ]
+
+    def test_export_notebooks_expand_rejected(self, exporter):
+        """Test that a rejected nested $expand falls back to batched page listings."""
+        import requests
+        
+        def fake_paginated(url):
+            if "$expand=pages" in url:
+                raise requests.exceptions.HTTPError("400 Bad Request", response=Mock(status_code=400))
+            assert "$expand=sections(" in url
+            return [{"id": "nb1", "displayName": "Notebook",
+                     "sections": [{"id": "s1", "displayName": "Section"}]}]
+        
+        def fake_batch(sub_requests):
+            responses = []
+            for sub_request in sub_requests:
+                url = sub_request["url"].partition("?")[0]
+                if url.endswith("/pages"):
+                    body = {"value": [{"id": "p1", "title": "One"}]}
+                else:
+                    body = "<html><body>content</body></html>"
+                responses.append({"status": 200, "body": body})
+            return responses
+        
+        with patch.object(exporter, 'call_graph_paginated', side_effect=fake_paginated) as mock_paginated, \
+                patch.object(exporter, 'call_graph_batch', side_effect=fake_batch), \
+                patch.object(exporter, 'export_page') as mock_export:
+            exporter.export_notebooks()
+        
+        assert mock_paginated.call_count == 2
+        assert [c.args[0]["id"] for c in mock_export.call_args_list] == ["p1"]
+    
+    def test_list_notebooks_throttled_not_fallback(self, exporter):
+        """Test that throttling outlasting the retries is not taken as a rejected $expand."""
+        import requests
+        
+        error = requests.exceptions.HTTPError("429 Too Many Requests", response=Mock(status_code=429))
+        with patch.object(exporter, 'call_graph_paginated', side_effect=error) as mock_paginated, \
+                pytest.raises(requests.exceptions.HTTPError):
+            exporter._list_notebooks()
+        
+        assert mock_paginated.call_count == 1
+    
+    def test_export_notebooks_expanded(self, exporter):
+        """Test that an inline $expand hierarchy needs no listing requests."""
+        notebooks = [{
+            "id": "nb1",
+            "displayName": "Notebook",
+            "sections": [{
+                "id": "s1",
+                "displayName": "Section",
+                "pages": [{"id": "p1", "title": "One"}],
+                "pages@odata.nextLink": "https://graph.microsoft.com/v1.0/next"
+            }]
+        }]
+        
+        def fake_paginated(url):
+            if url.endswith("/next"):
+                return [{"id": "p2", "title": "Two"}]
+            assert "$expand=sections(" in url
+            return notebooks
+        
+        def fake_batch(sub_requests):
+            assert all(r["url"].endswith("/content") for r in sub_requests)
+            return [{"status": 200, "body": "<p>content</p>"} for _ in sub_requests]
+        
+        with patch.object(exporter, 'call_graph_paginated', side_effect=fake_paginated), \
+                patch.object(exporter, 'call_graph_batch', side_effect=fake_batch) as mock_batch, \
+                patch.object(exporter, 'export_page') as mock_export:
+            exporter.export_notebooks()
+        
+        assert mock_batch.call_count == 1
+        assert sorted(c.args[0]["id"] for c in mock_export.call_args_list) == ["p1", "p2"]
+    
+    def test_export_notebooks_content_batch_failed(self, exporter):
+        """Test that a failed content batch leaves its pages to be fetched one by one."""
+        import requests
+        
+        notebooks = [{
+            "id": "nb1",
+            "displayName": "Notebook",
+            "sections": [{
+                "id": "s1",
+                "displayName": "Section",
+                "pages": [{"id": f"p{i}", "title": f"Page {i}"} for i in range(45)]
+            }]
+        }]
+        
+        def fake_batch(sub_requests):
+            if "/pages/p20/" in sub_requests[0]["url"]:
+                raise requests.exceptions.ConnectionError("connection reset")
+            return [{"status": 200, "body": "<p>content</p>"} for _ in sub_requests]
+        
+        with patch.object(exporter, 'call_graph_paginated', return_value=notebooks), \
+                patch.object(exporter, 'call_graph_batch', side_effect=fake_batch), \
+                patch.object(exporter, 'export_page') as mock_export:
+            exporter.export_notebooks()
+        
+        html_by_page = {c.args[0]["id"]: c.args[2] for c in mock_export.call_args_list}
+        assert len(html_by_page) == 45
+        assert html_by_page["p0"] == "<p>content</p>"
+        assert html_by_page["p20"] is None and html_by_page["p39"] is None
+        assert html_by_page["p40"] == "<p>content</p>"
+    
+    def test_ensure_dir_creates_once(self, exporter):
+        """Test that each directory is only created once per run."""
+        target = exporter.output_dir / "Notebook"
+        with patch.object(Path, 'mkdir', autospec=True, side_effect=Path.mkdir) as mock_mkdir:
+            exporter._ensure_dir(target)
+            exporter._ensure_dir(target)
+        
+        assert target.is_dir()
+        assert mock_mkdir.call_count == 1
     
     def test_sanitize_filename(self, exporter):
         """Test filename sanitization."""
@@ -283,12 +984,111 @@ class TestOneNoteExporter:
             ("Title with * asterisk", "Title with _ asterisk"),
             ("Title with ? question", "Title with _ question"),
             ("Title with < > brackets", "Title with _ _ brackets"),
+            ('Title with | pipe and "quotes"', "Title with _ pipe and _quotes_"),
         ]
         
         for input_title, expected in test_cases:
-            # This would be part of the export_page method
-            safe_title = input_title.replace("/", "_").replace("\\", "_").replace(":", "_").replace("*", "_").replace("?", "_").replace("<", "_").replace(">", "_")
-            assert safe_title == expected
+            assert OneNoteExporter._sanitize_title(input_title) == expected
+
+
+class TestThrottle:
+    """Test cases for the AIMD request throttle."""
+    
+    def test_decrease_on_throttle(self):
+        """Test multiplicative decrease on 429 and server errors."""
+        throttle = Throttle(initial=8)
+        throttle.acquire()
+        throttle.release(429, 0.1)
+        assert throttle.limit == 4
+        throttle.acquire()
+        throttle.release(503, 0.1)
+        assert throttle.limit == 2
+    
+    def test_increase_after_window(self):
+        """Test additive increase after a window of fast successes."""
+        throttle = Throttle(initial=2, window=5, target_latency=1.0)
+        for _ in range(5):
+            throttle.acquire()
+            throttle.release(200, 0.1)
+        assert throttle.limit == 3
+        
+        # Slow responses do not raise the limit
+        for _ in range(5):
+            throttle.acquire()
+            throttle.release(200, 5.0)
+        assert throttle.limit == 3
+    
+    def test_circuit_opens_on_sustained_errors(self):
+        """Test that a full window of errors pauses new requests."""
+        throttle = Throttle(initial=4, window=3)
+        for _ in range(3):
+            throttle.acquire()
+            throttle.release(0, 0.1)
+        assert throttle.limit == 1
+        assert throttle._open_until > 0
+
+
+class TestTokenBucket:
+    """Test cases for the client-side token bucket."""
+    
+    def test_burst_then_paced(self):
+        """Test that a full bucket allows a burst and then spaces requests out."""
+        bucket = TokenBucket(rate=10, capacity=3)
+        with patch('onenote_exporter.time.sleep') as mock_sleep:
+            for _ in range(3):
+                bucket.acquire()
+            mock_sleep.assert_not_called()
+            bucket.acquire()
+        assert 0.09 < mock_sleep.call_args.args[0] <= 0.1
+    
+    def test_drain_holds_refill(self):
+        """Test that a drained bucket makes every caller wait out the pause."""
+        bucket = TokenBucket(rate=10, capacity=30)
+        bucket.drain(5)
+        # A shorter pause never cuts an existing one short
+        bucket.drain(1)
+        with patch('onenote_exporter.time.sleep') as mock_sleep:
+            bucket.acquire()
+        assert 4.9 < mock_sleep.call_args.args[0] <= 5.1
+
+
+class TestRateLimitWindow:
+    """Test cases for header-driven request pacing."""
+    
+    def test_waits_for_reset_when_quota_low(self):
+        """Test that a nearly exhausted quota pauses until the reset."""
+        window = RateLimitWindow()
+        window.update({"RateLimit-Limit": "100", "RateLimit-Remaining": "2", "RateLimit-Reset": "5"})
+        
+        with patch('onenote_exporter.time.sleep', side_effect=lambda _: window.update({"RateLimit-Remaining": "100"})) as mock_sleep:
+            window.wait()
+        
+        assert mock_sleep.call_count == 1
+        assert 4 < mock_sleep.call_args.args[0] <= 5
+    
+    def test_sliding_window(self):
+        """Test that sends beyond the limit within the window are delayed."""
+        window = RateLimitWindow()
+        window.update({"x-ratelimit-limit": "2"})
+        
+        with patch('onenote_exporter.time.sleep') as mock_sleep:
+            window.wait()
+            window.wait()
+            mock_sleep.assert_not_called()
+            
+            window._sent[0] -= 61  # first send has left the window
+            window.wait()
+            mock_sleep.assert_not_called()
+    
+    def test_ignores_missing_headers(self):
+        """Test that responses without rate-limit headers never block."""
+        window = RateLimitWindow()
+        window.update(Mock())
+        window.update({})
+        with patch('onenote_exporter.time.sleep') as mock_sleep:
+            for _ in range(10):
+                window.wait()
+            mock_sleep.assert_not_called()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Persistent MSAL token cache shared by the exporter and the test scripts
+"""
+
+import os
+import logging
+import pathlib
+from typing import Optional
+
+TOKEN_CACHE_FILE = pathlib.Path.home() / ".cache" / "onenote-exporter" / "msal.bin"  # MSAL tokens shared by every script, readable only by the owner
+
+logger = logging.getLogger(__name__)
+
+
+def load_token_cache(path: Optional[pathlib.Path] = TOKEN_CACHE_FILE):
+    """Load the persisted MSAL token cache; a missing or unreadable file gives an empty cache."""
+    # Imported here: msal pulls in cryptography, which is slow to import
+    from msal import SerializableTokenCache
+
+    cache = SerializableTokenCache()
+    if path and path.exists():
+        try:
+            cache.deserialize(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable token cache {path}: {e}")
+    return cache
+
+
+def save_token_cache(cache, path: Optional[pathlib.Path] = TOKEN_CACHE_FILE) -> None:
+    """Persist the MSAL token cache with owner-only permissions.
+
+    Skipped when MSAL reports nothing new, e.g. a silent hit that reused
+    a still-valid access token.
+    """
+    if not path or not cache.has_state_changed:
+        return
+    try:
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(cache.serialize())
+        # os.open only applies the mode when it creates the file
+        os.chmod(path, 0o600)
+    except OSError as e:
+        logger.warning(f"Failed to save token cache {path}: {e}")